@@ -13,9 +13,17 @@
 Настройка админки модуля.
 """
 
+import re
+
 from django.contrib import admin
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Q
+
+from api.cache import BOARDS_SCOPE, board_scope, bump, clear
+from api.models import File, Post, Thread, Board, Rendition, ThumbnailJob, touch_threads
+from api.queries import SEARCH_CONFIG
 
-from api.models import File, Post, Thread, Board
+HASH_RE = re.compile(r'[0-9a-fA-F]{128}')
 
 
 def resolution(obj):
@@ -25,6 +33,64 @@ def resolution(obj):
     return f'{obj.width}x{obj.height}'
 
 
+class InvalidateCacheMixin:
+    """
+    Отмечает изменение тредов, затронутых правкой в админке (см. ``touch_threads``).
+    """
+
+    def get_affected_threads(self, queryset):
+        """
+        Треды, которые зависят от объектов ``queryset``.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, queryset):
+        touch_threads(self.get_affected_threads(queryset))
+
+    def save_model(self, request, obj, form, change):
+        if change:  # Старое состояние (например, пост переносят в другой тред)
+            self.invalidate(self.model.objects.filter(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        self.invalidate(self.model.objects.filter(pk=form.instance.pk))
+
+    def delete_model(self, request, obj):
+        self.invalidate(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        self.invalidate(queryset)
+        super().delete_queryset(request, queryset)
+
+
+class PostSearchMixin:
+    """
+    Ищет по полнотекстовому индексу постов (``Post.search_vector``) вместо ``icontains``
+    по всем полям, а также точно по почте и трипкоду (по их индексам).
+    Число ищется как номер поста, SHA512 — как хэш файла.
+    """
+    # Путь от модели админки к посту
+    post_path = ''
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        prefix = self.post_path
+        query = Q(**{f'{prefix}email': search_term}) | Q(**{f'{prefix}trip_code': search_term})
+        use_distinct = bool(prefix)
+        if search_term.isdigit():
+            query |= Q(**{f'{prefix}post_id': int(search_term)})
+        elif HASH_RE.fullmatch(search_term):
+            query |= Q(**{f'{prefix}files__hash': search_term.lower()})
+            use_distinct = True
+        else:
+            query |= Q(**{f'{prefix}search_vector': SearchQuery(search_term, config=SEARCH_CONFIG)})
+        return queryset.filter(query), use_distinct
+
+
 class FileToPostInline(admin.StackedInline):
     """
     Инлайн отношения пост-файл.
@@ -32,22 +98,45 @@ class FileToPostInline(admin.StackedInline):
     model = Post.files.through
 
 
+class RenditionInline(admin.TabularInline):
+    """
+    Инлайн вариантов эскиза.
+    """
+    model = Rendition
+    extra = 0
+
+
 @admin.register(File)
-class FileAdmin(admin.ModelAdmin):
+class FileAdmin(InvalidateCacheMixin, admin.ModelAdmin):
     """
     Админка модели File.
     """
     inlines = [
+        RenditionInline,
         FileToPostInline,
     ]
-    list_display = ('hash', 'filename', resolution, 'size', 'filetype', 'created_at', 'modified_at',)
-    list_filter = ('filetype',)
+    list_display = ('hash', 'filename', resolution, 'size', 'filetype', 'status', 'created_at', 'modified_at',)
+    list_filter = ('filetype', 'status',)
     search_fields = ['hash', 'filename', ]
+    readonly_fields = ('phash',)
     save_on_top = True
 
+    def get_affected_threads(self, queryset):
+        return Thread.objects.filter(posts__files__in=queryset)
+
+
+@admin.register(ThumbnailJob)
+class ThumbnailJobAdmin(admin.ModelAdmin):
+    """
+    Админка модели ThumbnailJob.
+    """
+    list_display = ('file', 'attempts', 'created_at',)
+    search_fields = ['file__hash', 'file__filename', ]
+    readonly_fields = ('error',)
+
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(PostSearchMixin, InvalidateCacheMixin, admin.ModelAdmin):
     """
     Админка модели Post.
     """
@@ -56,9 +145,12 @@ class PostAdmin(admin.ModelAdmin):
     ]
     list_display = ('post_id', 'banned', 'warned', 'email', 'name', 'created_at', 'modified_at',)
     list_filter = ('banned', 'warned', 'op',)
-    search_fields = ['post_id', 'text', 'email', 'name', 'subject', 'trip_code', 'files__filename', 'files__hash']
+    search_fields = ['post_id', 'search_vector', 'email', 'trip_code', 'files__hash']  # См. PostSearchMixin
     save_on_top = True
 
+    def get_affected_threads(self, queryset):
+        return Thread.objects.filter(posts__in=queryset)
+
 
 class PostInline(admin.StackedInline):
     """
@@ -68,19 +160,24 @@ class PostInline(admin.StackedInline):
 
 
 @admin.register(Thread)
-class ThreadAdmin(admin.ModelAdmin):
+class ThreadAdmin(PostSearchMixin, InvalidateCacheMixin, admin.ModelAdmin):
     """
     Админка модели Thread.
     """
     inlines = [
         PostInline,
     ]
-    list_display = ('__str__', 'board', 'last_bump_time', 'pinned', 'closed',)
+    list_display = ('__str__', 'board', 'last_bump_time', 'post_count', 'pinned', 'closed',)
+    list_select_related = ('op_post',)
     list_filter = ('posts__banned', 'posts__warned', 'posts__op', 'pinned', 'closed',)
-    search_fields = ['posts__post_id', 'posts__text', 'posts__email', 'posts__name', 'posts__subject',
-                     'posts__trip_code', 'posts__files__filename', 'posts__files__hash']
+    search_fields = ['posts__post_id', 'posts__search_vector', 'posts__email', 'posts__trip_code',
+                     'posts__files__hash']  # См. PostSearchMixin
+    post_path = 'posts__'
     save_on_top = True
 
+    def get_affected_threads(self, queryset):
+        return queryset
+
 
 class ThreadInline(admin.StackedInline):
     """
@@ -90,7 +187,7 @@ class ThreadInline(admin.StackedInline):
 
 
 @admin.register(Board)
-class BoardAdmin(admin.ModelAdmin):
+class BoardAdmin(InvalidateCacheMixin, admin.ModelAdmin):
     """
     Админка модели Board.
     """
@@ -100,3 +197,24 @@ class BoardAdmin(admin.ModelAdmin):
     list_display = ('board_name', 'description', 'pages', 'bump_limit')
     search_fields = ['board_name', 'description', 'default_name']
     save_on_top = True
+
+    def get_affected_threads(self, queryset):
+        return Thread.objects.filter(board__in=queryset)
+
+    def invalidate(self, queryset):
+        board_names = queryset.values_list('board_name', flat=True)
+        bump(BOARDS_SCOPE, *[board_scope(board_name) for board_name in board_names])
+        super().invalidate(queryset)
+
+    def save_model(self, request, obj, form, change):
+        if change and 'board_name' in form.changed_data:  # Ключи по старому имени больше не годятся
+            clear()
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        clear()
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        clear()
+        super().delete_queryset(request, queryset)
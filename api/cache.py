@@ -0,0 +1,196 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Кэш готовых JSON-ответов API.
+
+Ключ ответа включает версии его областей (``boards``, ``board:<имя>``, ``thread:<pk>``).
+Любое изменение увеличивает версии затронутых областей, после чего старые ответы
+просто перестают запрашиваться и вытесняются кэшем сами.
+Части ключей берутся из URL (имя доски и т. п.), поэтому в кэш идут не сами ключи,
+а их хэши (``make_key``): memcached не принимает длинные ключи и ключи с пробелами.
+"""
+
+import hashlib
+import logging
+import time
+from typing import Callable, Iterable, List, Optional
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from gchan import settings
+
+log = logging.getLogger(__name__)
+
+BOARDS_SCOPE = 'boards'
+
+
+def get_cache():
+    """
+    Кэш ответов (``RESPONSE_CACHE_ALIAS``).
+    """
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def make_key(key: str) -> str:
+    """
+    Ключ кэша из логического ключа: фиксированной длины и без недопустимых символов.
+    """
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def board_scope(board_name: str) -> str:
+    """
+    Область страниц доски: меняется с каждым постом на доске.
+    """
+    return f'board:{board_name}'
+
+
+def thread_scope(thread_pk: int) -> str:
+    """
+    Область треда и его постов.
+    """
+    return f'thread:{thread_pk}'
+
+
+def get_versions(scopes: List[str]) -> List[int]:
+    """
+    Текущие версии областей. Отсутствующая версия начинается с текущего времени
+    в миллисекундах: если кэш вытеснил счетчик, новая версия не совпадет со старой.
+    """
+    cache = get_cache()
+    keys = [make_key(f'version:{scope}') for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes: str):
+    """
+    Увеличивает версии областей после коммита текущей транзакции
+    (чтобы никто не закэшировал ответ со старыми данными под новой версией).
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+
+    def do_bump():
+        cache = get_cache()
+        for scope in set(scopes):
+            try:
+                cache.incr(make_key(f'version:{scope}'))
+            except ValueError:  # Версии нет — значит, и ответов под ней нет
+                pass
+
+    transaction.on_commit(do_bump)
+
+
+def clear():
+    """
+    Очищает весь кэш ответов после коммита текущей транзакции.
+    Нужно, когда ключи по имени доски начинают указывать на другие данные
+    (доску переименовали или удалили).
+    """
+    if settings.RESPONSE_CACHE_ENABLED:
+        transaction.on_commit(get_cache().clear)
+
+
+def invalidate_threads(threads):
+    """
+    Увеличивает версии тредов и их досок.
+
+    :param threads: ``QuerySet`` тредов.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+    scopes = []
+    for thread_pk, board_name in threads.values_list('pk', 'board__board_name').distinct():
+        scopes += [thread_scope(thread_pk), board_scope(board_name)]
+    if scopes:
+        bump(*scopes)
+
+
+def count(name: str):
+    """
+    Увеличивает счетчик статистики кэша (``hits`` или ``misses``).
+    """
+    cache = get_cache()
+    key = f'stats:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_stats() -> dict:
+    """
+    Счетчики попаданий и промахов.
+    """
+    stats = get_cache().get_many(['stats:hits', 'stats:misses'])
+    return {'hits': stats.get('stats:hits', 0), 'misses': stats.get('stats:misses', 0)}
+
+
+def remember(key: str, get_value: Callable[[], Optional[int]]) -> Optional[int]:
+    """
+    Кэширует неизменяемое значение (например, ``pk`` треда, в котором лежит пост).
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return get_value()
+    cache = get_cache()
+    key = make_key(key)
+    value = cache.get(key)
+    if value is None:
+        value = get_value()
+        if value is not None:
+            cache.set(key, value, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return value
+
+
+def cached_json(key: str, scopes: Iterable[str], build: Callable[[], HttpResponse]) -> HttpResponse:
+    """
+    Отдает JSON-ответ из кэша или строит его и кэширует.
+    Кэшируются только ответы с кодом 200. Ключ кэша и оставшееся время жизни ответа
+    сохраняются в ответе (``compression_cache_key``, ``compression_cache_timeout``),
+    чтобы сжатые варианты тоже кэшировались, но не пережили ответ со ссылками на файлы.
+
+    :param key: Ключ ответа без версий.
+    :param scopes: Области, от которых зависит ответ.
+    :param build: Функция, строящая ответ.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return build()
+    scopes = list(scopes)
+    # Версии читаются до построения ответа: если данные изменятся во время построения,
+    # ответ ляжет под уже устаревший ключ и не будет отдан.
+    versions = get_versions(scopes)
+    full_key = make_key('response:' + key + ':' + '.'.join(map(str, versions)))
+    cache = get_cache()
+    cached = cache.get(full_key)
+    if cached is not None:
+        count('hits')
+        expires_at, content = cached
+        response = HttpResponse(content, content_type='application/json')
+        response.compression_cache_key = full_key
+        response.compression_cache_timeout = max(1, int(expires_at - time.time()))
+        return response
+
+    count('misses')
+    response = build()
+    if response.status_code == 200:
+        timeout = settings.RESPONSE_CACHE_TIMEOUT
+        cache.set(full_key, (time.time() + timeout, response.content), timeout=timeout)
+        response.compression_cache_key = full_key
+        response.compression_cache_timeout = timeout
+    return response
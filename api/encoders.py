@@ -0,0 +1,98 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Кодирование JSON-ответов API.
+
+Если установлен ``orjson``, JSON кодируется им, иначе — стандартным ``json``
+(выбор задается настройкой ``JSON_ENCODER``). Оба варианта дают компактный
+JSON в UTF-8 и одинаково форматируют даты: как ``DateTimeField`` DRF,
+так что даты из сериализаторов и из остального кода выглядят одинаково.
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Callable
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.fields import DateTimeField
+
+from gchan import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_format_datetime = DateTimeField().to_representation
+_django_encoder = DjangoJSONEncoder()
+
+
+def default(obj: Any) -> Any:
+    """
+    Представление объектов, которых нет в JSON: даты — в формате DRF,
+    остальное (UUID, Decimal, ленивые строки...) — как в ``DjangoJSONEncoder``.
+    """
+    if isinstance(obj, datetime):
+        return _format_datetime(obj)
+    return _django_encoder.default(obj)
+
+
+class StdlibEncoder(json.JSONEncoder):
+    """
+    Стандартный кодировщик с той же обработкой дат, что и у ``orjson``.
+    """
+
+    def default(self, obj):
+        return default(obj)
+
+
+def encode_stdlib(data: Any) -> bytes:
+    """
+    Кодирует JSON стандартным ``json``.
+    """
+    return json.dumps(data, cls=StdlibEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def encode_orjson(data: Any) -> bytes:
+    """
+    Кодирует JSON через ``orjson``; даты форматирует ``default``.
+    """
+    return orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def get_encoder() -> Callable[[Any], bytes]:
+    """
+    Кодировщик по настройке ``JSON_ENCODER``: ``orjson``, ``stdlib``
+    или ``auto`` (``orjson``, если он установлен).
+    """
+    if settings.JSON_ENCODER == 'stdlib' or (settings.JSON_ENCODER == 'auto' and orjson is None):
+        return encode_stdlib
+    if orjson is None:
+        raise ImportError('JSON_ENCODER is "orjson", but orjson is not installed')
+    return encode_orjson
+
+
+encode = get_encoder()
+
+
+class JsonResponse(HttpResponse):
+    """
+    Замена ``django.http.JsonResponse``, кодирующая данные через ``encode``.
+    Тело ответа — готовые байты, их можно класть в кэш как есть.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=encode(data), **kwargs)
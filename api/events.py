@@ -0,0 +1,257 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+События для живого обновления тредов и досок (Server-Sent Events).
+
+Посты публикуются в брокер после коммита (см. ``publish``), а потоковые
+эндпоинты подписываются на каналы ``board:<имя>`` и ``thread:<pk>``.
+Брокер выбирается настройкой ``EVENTS_BROKER``.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from api.encoders import encode
+from gchan import settings
+
+log = logging.getLogger(__name__)
+
+RESET_EVENT = 'reset'
+
+
+def board_channel(board_name: str) -> str:
+    """
+    Канал доски: новые посты и бампы всех ее тредов.
+    """
+    return f'board:{board_name}'
+
+
+def thread_channel(thread_pk: int) -> str:
+    """
+    Канал треда: новые посты.
+    """
+    return f'thread:{thread_pk}'
+
+
+class Event(NamedTuple):
+    """
+    Событие в канале.
+    ``RESET_EVENT`` означает, что часть событий потеряна и клиенту нужно перезапросить данные.
+    """
+    id: int
+    type: str
+    data: dict
+
+
+class Subscription:
+    """
+    Подписка на канал.
+    """
+
+    def get(self, timeout: float) -> Optional[Event]:
+        """
+        Ждет следующее событие.
+
+        :param timeout: Сколько ждать, в секундах.
+        :return: Событие или ``None``, если за ``timeout`` ничего не пришло.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Отписывается от канала.
+        """
+        raise NotImplementedError
+
+
+class Broker:
+    """
+    Интерфейс брокера событий.
+    """
+    # Доставляет ли брокер события между процессами (и серверами)
+    shared = False
+
+    def publish(self, channels: List[str], event_type: str, data: dict):
+        """
+        Отправляет событие всем подписчикам каналов.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Подписывается на канал.
+
+        :param channel: Канал.
+        :param last_event_id: Последнее полученное клиентом событие: пропущенные
+            после него события будут отданы первыми.
+        """
+        raise NotImplementedError
+
+
+class InMemorySubscription(Subscription):
+    """
+    Подписка ``InMemoryBroker``: ограниченная очередь событий.
+    Если клиент не успевает забирать события и очередь переполнена, вместо
+    новых событий он получает ``RESET_EVENT`` — публикация никогда не ждет подписчиков.
+    """
+
+    def __init__(self, broker: 'InMemoryBroker', channel: str):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event: Event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Event]:
+        if self.overflowed and self.queue.empty():
+            return Event(id=0, type=RESET_EVENT, data={})
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return Event(id=0, type=RESET_EVENT, data={}) if self.overflowed else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker(Broker):
+    """
+    Брокер в памяти процесса: подходит для одного процесса и для тестов.
+    Последние ``EVENTS_HISTORY`` событий каждого канала хранятся для возобновления по ``Last-Event-ID``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Номера начинаются со времени запуска, чтобы после перезапуска процесса
+        # не начинаться заново и не путать клиентов с сохраненным Last-Event-ID.
+        self.first_id = int(time.time() * 1000)
+        self.ids = itertools.count(self.first_id)
+        self.history: Dict[str, deque] = {}
+        # Номер последнего события канала, вытесненного из истории
+        self.evicted: Dict[str, int] = {}
+        self.subscribers: Dict[str, Set[InMemorySubscription]] = {}
+
+    def publish(self, channels: List[str], event_type: str, data: dict):
+        with self.lock:
+            event = Event(id=next(self.ids), type=event_type, data=data)
+            for channel in channels:
+                history = self.history.setdefault(channel, deque(maxlen=settings.EVENTS_HISTORY))
+                if len(history) == history.maxlen:
+                    self.evicted[channel] = history[0].id
+                history.append(event)
+                for subscription in self.subscribers.get(channel, ()):
+                    subscription.put(event)
+
+    def subscribe(self, channel: str, last_event_id: Optional[int] = None) -> Subscription:
+        subscription = InMemorySubscription(self, channel)
+        with self.lock:
+            if last_event_id is not None:
+                missed = [event for event in self.history.get(channel, ()) if event.id > last_event_id]
+                # Событие до запуска процесса (история не сохранилась) или часть пропущенных событий вытеснена
+                if last_event_id < self.first_id or last_event_id < self.evicted.get(channel, 0):
+                    subscription.overflowed = True
+                for event in missed:
+                    subscription.put(event)
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: InMemorySubscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+
+_broker: Optional[Broker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Broker:
+    """
+    Брокер событий процесса (класс из ``EVENTS_BROKER``).
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+        return _broker
+
+
+def streams_enabled() -> bool:
+    """
+    Включены ли потоки событий: брокер общий для всех процессов, или сайт
+    работает в одном процессе (``EVENTS_SINGLE_PROCESS``). Иначе подписчики
+    одного процесса не получали бы посты, созданные в другом.
+    """
+    return get_broker().shared or settings.EVENTS_SINGLE_PROCESS
+
+
+def publish(channels: List[str], event_type: str, data: dict):
+    """
+    Публикует событие после коммита текущей транзакции: подписчики
+    не увидят пост, который потом откатится.
+    """
+    if not streams_enabled():
+        return
+
+    def do_publish():
+        try:
+            get_broker().publish(channels, event_type, data)
+        except Exception:
+            log.exception('Failed to publish %s event.', event_type)
+
+    transaction.on_commit(do_publish)
+
+
+def stream(channel: str, last_event_id: Optional[int] = None) -> Iterator[str]:
+    """
+    Подписывается на канал и отдает его события в формате ``text/event-stream``.
+    Пока событий нет, раз в ``EVENTS_HEARTBEAT`` секунд отправляется комментарий, чтобы
+    прокси не закрывали соединение. Через ``EVENTS_STREAM_TIMEOUT`` секунд поток
+    завершается, и клиент переподключается с ``Last-Event-ID``: так поток не занимает
+    воркер бесконечно.
+    """
+    # Ответ уже сформирован, а соединение с базой потоку не нужно
+    connection.close()
+    deadline = time.monotonic() + settings.EVENTS_STREAM_TIMEOUT
+    subscription = get_broker().subscribe(channel, last_event_id)
+    try:
+        yield f'retry: {settings.EVENTS_RETRY * 1000}\n\n'
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=settings.EVENTS_HEARTBEAT)
+            if event is None:
+                yield ': heartbeat\n\n'
+                continue
+            data = encode(event.data).decode()
+            if event.type == RESET_EVENT:
+                yield f'event: {event.type}\ndata: {data}\n\n'
+                break
+            yield f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'
+    finally:
+        subscription.close()
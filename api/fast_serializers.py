@@ -0,0 +1,148 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Быстрая сериализация для чтения.
+
+Дает тот же JSON, что и сериализаторы из ``api.serializers``, но собирает словари
+прямо из кортежей ``values_list``: без экземпляров моделей, полей DRF и вызова
+``FieldFile.url`` на каждый файл. Порядок и набор ключей берутся из DRF-сериализаторов,
+так что новые поля моделей подхватываются сами. Соответствие проверяется
+командой ``check_fast_serializers``.
+"""
+
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.db import models
+from django.utils.encoding import filepath_to_uri
+from rest_framework.fields import DateTimeField
+
+from api.models import Board, File, Post, Rendition
+from api.serializers import BoardSerializer, FileSerializer, PostSerializer, RenditionSerializer, ThreadSerializer
+
+URL_PROBE = 'probe'
+
+
+def storage_url(storage) -> Callable[[str], Optional[str]]:
+    """
+    Функция, строящая ссылку на файл в хранилище.
+    Если ссылки хранилища — это общий префикс плюс имя файла, префикс вычисляется
+    один раз; иначе (например, подписанные ссылки S3) используется ``storage.url``.
+    """
+    url = storage.url(URL_PROBE)
+    if url.endswith(URL_PROBE) and '?' not in url:
+        prefix = url[:-len(URL_PROBE)]
+        return lambda name: prefix + filepath_to_uri(name) if name else None
+    return lambda name: storage.url(name) if name else None
+
+
+class RowSerializer:
+    """
+    Собирает словари в порядке полей DRF-сериализатора из кортежей ``values_list(*columns)``.
+    Вложенные поля передаются готовыми в ``to_dict``.
+    """
+
+    def __init__(self, serializer_class, nested=()):
+        model = serializer_class.Meta.model
+        datetime_field = DateTimeField()  # Тот же формат дат, что и в DRF
+        self.keys = list(serializer_class().fields)
+        self.columns = [key for key in self.keys if key not in nested]
+        self.converters = {}
+        for column in self.columns:
+            field = model._meta.get_field(column)
+            if isinstance(field, models.DateTimeField):
+                self.converters[column] = datetime_field.to_representation
+            elif isinstance(field, models.FileField):
+                self.converters[column] = storage_url(field.storage)
+
+    def to_dict(self, row: Iterable, **nested) -> Dict:
+        result = dict(zip(self.columns, row))
+        for column, converter in self.converters.items():
+            if result[column] is not None:
+                result[column] = converter(result[column])
+        return {key: nested[key] if key in nested else result[key] for key in self.keys}
+
+
+_serializers: Dict[str, RowSerializer] = {}
+
+
+def get_row_serializer(name: str) -> RowSerializer:
+    """
+    Сериализаторы строятся при первом использовании: хранилища файлов
+    к этому моменту уже настроены.
+    """
+    if not _serializers:
+        _serializers.update({
+            'rendition': RowSerializer(RenditionSerializer),
+            'file': RowSerializer(FileSerializer, nested=('renditions',)),
+            'post': RowSerializer(PostSerializer, nested=('files',)),
+            'board': RowSerializer(BoardSerializer),
+            'thread': RowSerializer(ThreadSerializer, nested=('posts', 'board')),
+        })
+    return _serializers[name]
+
+
+def serialize_posts(posts) -> List[Dict]:
+    """
+    Сериализует посты как ``PostSerializer(posts, many=True)``.
+    Запросы: посты, их файлы и варианты эскизов — независимо от количества постов.
+
+    :param posts: ``QuerySet`` постов (порядок сохраняется).
+    """
+    post_serializer = get_row_serializer('post')
+    file_serializer = get_row_serializer('file')
+    rendition_serializer = get_row_serializer('rendition')
+
+    post_rows = list(posts.values_list('pk', *post_serializer.columns))
+    if not post_rows:
+        return []
+    # Тот же запрос, что делает prefetch_related('files'): с тем же порядком файлов
+    file_rows = list(File.objects.filter(post__in=[row[0] for row in post_rows])
+                     .values_list('post', 'pk', *file_serializer.columns))
+    renditions = defaultdict(list)
+    rendition_rows = Rendition.objects.filter(file__in={row[1] for row in file_rows}) \
+        .values_list('file', *rendition_serializer.columns)
+    for row in rendition_rows:
+        renditions[row[0]].append(rendition_serializer.to_dict(row[1:]))
+
+    files = defaultdict(list)
+    for row in file_rows:
+        files[row[0]].append(file_serializer.to_dict(row[2:], renditions=renditions[row[1]]))
+    return [post_serializer.to_dict(row[1:], files=files[row[0]]) for row in post_rows]
+
+
+def serialize_board(board_name: str) -> Optional[Dict]:
+    """
+    Сериализует доску как ``BoardSerializer``.
+    """
+    board_serializer = get_row_serializer('board')
+    row = Board.objects.filter(board_name=board_name).values_list(*board_serializer.columns).first()
+    return None if row is None else board_serializer.to_dict(row)
+
+
+def serialize_thread(threads, with_posts: bool = True) -> Optional[Dict]:
+    """
+    Сериализует тред как ``ThreadSerializer``.
+
+    :param threads: ``QuerySet``, выбирающий тред.
+    :param with_posts: Загружать ли посты (иначе ``posts`` — пустой список).
+    :return: Словарь треда или ``None``, если треда нет.
+    """
+    thread_serializer = get_row_serializer('thread')
+    row = threads.values_list('pk', 'board', *thread_serializer.columns).first()
+    if row is None:
+        return None
+    return thread_serializer.to_dict(
+        row[2:],
+        posts=serialize_posts(Post.objects.filter(thread=row[0])) if with_posts else [],
+        board=serialize_board(row[1]),
+    )
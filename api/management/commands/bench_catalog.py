@@ -0,0 +1,97 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Бенчмарк каталога: построение каталога заполненной доски
+(``pages * THREADS_PER_PAGE`` тредов с файлами) должно укладываться в бюджет.
+"""
+
+import statistics
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.models import Board, File, Post, Thread, THREADS_PER_PAGE
+from api.queries import get_catalog
+
+BENCH_BOARD_NAME = '__bench'
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время построения каталога заполненной доски. Все изменения откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10,
+                            help='Количество страниц доски.')
+        parser.add_argument('--samples', type=int, default=20,
+                            help='Сколько раз строить каталог.')
+        parser.add_argument('--budget', type=float, default=50.0,
+                            help='Допустимая медиана в миллисекундах.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            board = self._fill(options['pages'])
+            with CaptureQueriesContext(connection) as queries:
+                get_catalog(board)
+            timings = []
+            for _ in range(options['samples']):
+                started = time.perf_counter()
+                get_catalog(board)
+                timings.append((time.perf_counter() - started) * 1000)
+            transaction.set_rollback(True)
+
+        median = statistics.median(timings)
+        p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+        self.stdout.write(f'{options["pages"] * THREADS_PER_PAGE} threads: median {median:.2f} ms, '
+                          f'p95 {p95:.2f} ms, {len(queries)} queries')
+        if median > options['budget']:
+            raise CommandError(f'Catalog is over budget ({median:.2f} > {options["budget"]} ms)')
+
+    @staticmethod
+    def _fill(pages) -> Board:
+        """
+        Создает доску, заполненную тредами с ОП-постами и файлами.
+        """
+        now = timezone.now()
+        board = Board.objects.create(
+            board_name=BENCH_BOARD_NAME,
+            description='benchmark',
+            pages=pages,
+            bump_limit=500,
+            default_name='Anon',
+            max_file_size=1024,
+            max_text_size=1024,
+            closed=False
+        )
+        count = pages * THREADS_PER_PAGE
+        threads = Thread.objects.bulk_create([
+            Thread(pinned=False, closed=False, board=board, last_bump_time=now) for _ in range(count)
+        ])
+        posts = Post.objects.bulk_create([
+            Post(post_id=i + 1, text='bench ' * 100, name='Anon', thread=thread, board=board,
+                 created_at=now, modified_at=now)
+            for i, thread in enumerate(threads)
+        ])
+        files = File.objects.bulk_create([
+            File(hash=f'{BENCH_BOARD_NAME}{i}', filename='bench.jpg', size=1, content=f'c_bench{i}',
+                 preview_content=f'p_bench{i}', thumbnailWidth=250, thumbnailHeight=250,
+                 filetype=File.FileTypeEnum.JPEG.value, created_at=now, modified_at=now)
+            for i in range(count)
+        ])
+        Post.files.through.objects.bulk_create([
+            Post.files.through(post_id=post.pk, file_id=file.pk) for post, file in zip(posts, files)
+        ])
+        for thread, post in zip(threads, posts):
+            Thread.objects.filter(pk=thread.pk).update(op_post=post, post_count=1, file_post_count=1)
+        return board
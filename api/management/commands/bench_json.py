@@ -0,0 +1,108 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Микробенчмарк кодирования JSON: большой тред, закодированный прежним способом
+(``DjangoJSONEncoder``) и доступными кодировщиками из ``api.encoders``.
+"""
+
+import json
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from api import encoders
+
+
+def make_thread(posts: int) -> dict:
+    """
+    Тред той же формы, что отдает ``get_thread``: у каждого поста файл с двумя вариантами эскиза.
+    """
+    now = timezone.now().isoformat()
+    file_hash = 'f' * 128
+    return {
+        'posts': [{
+            'files': [{
+                'hash': file_hash,
+                'renditions': [
+                    {'name': name, 'format': 'JPEG', 'width': size, 'height': size,
+                     'content': f'https://example.s3.amazonaws.com/r_{file_hash}_{name}'}
+                    for name, size in (('placeholder', 16), ('thumb2x', 500))
+                ],
+                'filename': 'image.jpg',
+                'width': 4000,
+                'height': 3000,
+                'size': 1215140,
+                'content': f'https://example.s3.amazonaws.com/c_{file_hash}',
+                'preview_content': f'https://example.s3.amazonaws.com/p_{file_hash}',
+                'thumbnailWidth': 250,
+                'thumbnailHeight': 187,
+                'filetype': 'jpg',
+                'status': 'ready',
+                'duration': None,
+                'frame_count': None,
+                'created_at': now,
+            }],
+            'post_id': post_id,
+            'banned': False,
+            'warned': False,
+            'text': 'Какой-то там таки текст, да. ' * 10,
+            'email': '',
+            'name': 'Анонимус',
+            'subject': '',
+            'trip_code': '',
+            'op': post_id == 1,
+            'created_at': now,
+        } for post_id in range(1, posts + 1)],
+        'board': {'board_name': 'b', 'description': 'Бред', 'pages': 10, 'bump_limit': 500,
+                  'default_name': 'Анонимус', 'max_file_size': 20480, 'max_text_size': 15000,
+                  'preview_posts': 3, 'closed': False},
+        'pinned': False,
+        'closed': False,
+        'last_bump_time': now,
+        'post_count': posts,
+        'file_post_count': posts,
+        'last_post_id': posts,
+        'modified_at': now,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Замеряет кодирование JSON большого треда разными кодировщиками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500,
+                            help='Количество постов в треде.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз кодировать.')
+
+    def handle(self, *args, **options):
+        data = make_thread(options['posts'])
+        candidates = [
+            ('DjangoJSONEncoder', lambda value: json.dumps(value, cls=DjangoJSONEncoder).encode()),
+            ('stdlib', encoders.encode_stdlib),
+        ]
+        if encoders.orjson is not None:
+            candidates.append(('orjson', encoders.encode_orjson))
+        else:
+            self.stdout.write('orjson is not installed, skipping it')
+
+        for name, encode in candidates:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                content = encode(data)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{name:>17}: median {statistics.median(timings):.2f} ms, {len(content)} bytes')
+        self.stdout.write(f'Used for responses: {encoders.encode.__name__}')
@@ -0,0 +1,107 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Регрессионный бенчмарк постинга: задержка создания поста
+не должна расти вместе с количеством постов в базе.
+"""
+
+import statistics
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Board, Thread, Post
+
+BENCH_BOARD_NAME = '__bench'
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку создания поста при разном количестве постов в базе. ' \
+           'Все изменения откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                            help='Количество постов на доске перед замером.')
+        parser.add_argument('--samples', type=int, default=50,
+                            help='Сколько постов создавать на каждом шаге.')
+        parser.add_argument('--max-ratio', type=float, default=2.0,
+                            help='Допустимое отношение медиан последнего и первого шага.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        medians = []
+        with transaction.atomic():
+            board = Board.objects.create(
+                board_name=BENCH_BOARD_NAME,
+                description='benchmark',
+                pages=1,
+                bump_limit=500,
+                default_name='Anon',
+                max_file_size=1024,
+                max_text_size=1024,
+                closed=False
+            )
+            thread = Thread.objects.create(pinned=False, closed=False, board=board)
+            for size in sizes:
+                self._fill(board, thread, size)
+                timings = [self._post(board, thread) for _ in range(options['samples'])]
+                median = statistics.median(timings)
+                p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+                medians.append(median)
+                self.stdout.write(f'{size:>10} posts: median {median:.2f} ms, p95 {p95:.2f} ms')
+            transaction.set_rollback(True)
+
+        ratio = medians[-1] / medians[0]
+        self.stdout.write(f'Latency ratio {sizes[-1]}/{sizes[0]}: {ratio:.2f}')
+        if ratio > options['max_ratio']:
+            raise CommandError(f'Posting latency grows with post count ({ratio:.2f} > {options["max_ratio"]})')
+
+    @staticmethod
+    def _fill(board, thread, size):
+        """
+        Дозаполняет доску постами до ``size`` штук.
+        """
+        now = timezone.now()
+        existing = Post.objects.filter(board=board).count()
+        while existing < size:
+            count = min(BATCH_SIZE, size - existing)
+            start = board.last_post_id + 1
+            Post.objects.bulk_create([
+                Post(post_id=start + i, text='bench', name='Anon', thread=thread, board=board,
+                     created_at=now, modified_at=now)
+                for i in range(count)
+            ])
+            board.last_post_id += count
+            Board.objects.filter(pk=board.pk).update(last_post_id=board.last_post_id)
+            existing += count
+
+    @staticmethod
+    def _post(board, thread) -> float:
+        """
+        Создает один пост так же, как ``create_post_or_thread``.
+
+        :return: Затраченное время в миллисекундах.
+        """
+        started = time.perf_counter()
+        with transaction.atomic():
+            post = Post.objects.create(
+                post_id=board.reserve_post_id(),
+                text='bench',
+                name=board.default_name,
+                thread=thread,
+                board=board
+            )
+            post.full_clean()
+        return (time.perf_counter() - started) * 1000
@@ -0,0 +1,78 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Сравнивает старый и новый способ создания эскизов на наборе картинок.
+"""
+
+import statistics
+import time
+from io import BytesIO
+
+from PIL import Image
+from django.core.management import BaseCommand
+from filetype import filetype
+
+from api.media import MAX_THUMB_SIZE, make_thumbnail, open_image
+
+
+def legacy_thumbnail(data: bytes, quality: int) -> bytes:
+    """
+    Эскиз так, как его делал ``upload_file`` раньше:
+    полное декодирование и LANCZOS с исходного разрешения.
+    """
+    image = Image.open(BytesIO(data))
+    resize_ratio = min(MAX_THUMB_SIZE / image.width, MAX_THUMB_SIZE / image.height)
+    thumbnail = image.resize((int(image.width * resize_ratio), int(image.height * resize_ratio)),
+                             Image.LANCZOS)
+    thumbnail = thumbnail.convert('RGB')
+    thumbnail_bytes = BytesIO()
+    thumbnail.save(thumbnail_bytes, format='JPEG', quality=quality)
+    return thumbnail_bytes.getvalue()
+
+
+def fast_thumbnail(data: bytes, quality: int) -> bytes:
+    """
+    Эскиз через ``api.media.make_thumbnail``.
+    """
+    image = open_image(BytesIO(data))
+    return make_thumbnail(image, filetype.guess(data).EXTENSION, quality)[2]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время создания эскизов старым и новым способом.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help='Пути к эталонным картинкам.')
+        parser.add_argument('--repeat', type=int, default=10, help='Повторов на картинку.')
+        parser.add_argument('--quality', type=int, default=70, help='Качество JPEG.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"image":<40} {"size":>11} {"legacy ms":>10} {"fast ms":>10} {"speedup":>8}')
+        for path in options['images']:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            size = '{}x{}'.format(*Image.open(BytesIO(data)).size)
+            legacy = self._measure(legacy_thumbnail, data, options)
+            fast = self._measure(fast_thumbnail, data, options)
+            self.stdout.write(f'{path[-40:]:<40} {size:>11} {legacy:>10.2f} {fast:>10.2f} {legacy / fast:>7.1f}x')
+
+    @staticmethod
+    def _measure(func, data, options) -> float:
+        """
+        Медиана времени вызова ``func`` в миллисекундах.
+        """
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            func(data, options['quality'])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
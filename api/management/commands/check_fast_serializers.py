@@ -0,0 +1,61 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Проверяет, что ``api.fast_serializers`` дают тот же JSON, что и DRF-сериализаторы,
+и сравнивает их скорость.
+"""
+
+import json
+import time
+
+from django.core.management import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import serialize_thread
+from api.models import Thread
+from api.serializers import ThreadSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает вывод быстрых сериализаторов с DRF на последних тредах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20,
+                            help='Сколько последних тредов проверить.')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        mismatched = []
+        drf_time = fast_time = 0.0
+        thread_ids = Thread.objects.order_by('-pk').values_list('pk', flat=True)[:options['threads']]
+        for thread_id in thread_ids:
+            started = time.perf_counter()
+            thread = ThreadSerializer.setup_eager_loading(Thread.objects).get(pk=thread_id)
+            expected = renderer.render(ThreadSerializer(thread).data)
+            drf_time += time.perf_counter() - started
+
+            started = time.perf_counter()
+            actual = renderer.render(serialize_thread(Thread.objects.filter(pk=thread_id)))
+            fast_time += time.perf_counter() - started
+
+            if json.loads(expected) != json.loads(actual):
+                mismatched.append(thread_id)
+                self.stderr.write(f'Thread {thread_id} differs:\n'
+                                  f'  DRF:  {expected.decode()}\n  fast: {actual.decode()}')
+            elif expected != actual:
+                self.stderr.write(f'Thread {thread_id}: same data, different key order')
+                mismatched.append(thread_id)
+
+        self.stdout.write(f'Checked {len(thread_ids)} threads: DRF {drf_time * 1000:.1f} ms, '
+                          f'fast {fast_time * 1000:.1f} ms')
+        if mismatched:
+            raise CommandError(f'Fast serializers differ from DRF on threads {mismatched}')
@@ -0,0 +1,49 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Удаляет истекшие сессии загрузки по частям и их файлы,
+а также файлы в ``UPLOAD_SPOOL_DIR``, для которых не осталось сессий.
+"""
+
+import os
+import time
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from api.models import UploadSession
+from gchan import settings
+
+
+class Command(BaseCommand):
+    help = 'Удаляет истекшие сессии загрузки по частям и их файлы.'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(expires_at__lte=timezone.now())
+        expired_ids = [str(session_id) for session_id in expired.values_list('pk', flat=True)]
+        expired.filter(pk__in=expired_ids).delete()
+
+        removed = 0
+        if os.path.isdir(settings.UPLOAD_SPOOL_DIR):
+            alive = {str(session_id) for session_id in UploadSession.objects.values_list('pk', flat=True)}
+            # Свежие файлы без сессии могут быть только что созданы — их не трогаем.
+            min_mtime = time.time() - settings.UPLOAD_SESSION_TTL
+            for entry in os.scandir(settings.UPLOAD_SPOOL_DIR):
+                if entry.name in alive:
+                    continue
+                if entry.name in expired_ids or entry.stat().st_mtime < min_mtime:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:  # Успел удалить finish_upload
+                        pass
+        self.stdout.write(f'Removed {len(expired_ids)} expired sessions, {removed} spool files')
@@ -0,0 +1,39 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Удаляет треды, не помещающиеся на страницы досок.
+Нужна, если включен ``DEFERRED_PRUNING``.
+"""
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from api.models import Board
+
+
+class Command(BaseCommand):
+    help = 'Удаляет треды, не помещающиеся на страницы досок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('boards', nargs='*', metavar='board_name',
+                            help='Доски для очистки (по умолчанию все).')
+
+    def handle(self, *args, **options):
+        boards = Board.objects.all()
+        if options['boards']:
+            boards = boards.filter(board_name__in=options['boards'])
+        for board in boards:
+            with transaction.atomic():
+                # Та же блокировка строки доски, что и при постинге.
+                board = Board.objects.select_for_update().get(pk=board.pk)
+                pruned = board.prune_threads()
+            self.stdout.write(f'/{board.board_name}/: pruned {len(pruned)} threads {pruned}')
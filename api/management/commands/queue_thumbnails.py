@@ -0,0 +1,39 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Ставит файлы в очередь на пересоздание эскизов.
+"""
+
+from django.core.management import BaseCommand
+from django.db.models import Count, Q
+
+from api.models import File, ThumbnailJob
+from gchan import settings
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь thumbnail_worker файлы, у которых не хватает вариантов эскиза ' \
+           'или перцептивного хэша.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать эскизы всех файлов.')
+
+    def handle(self, *args, **options):
+        files = File.objects.filter(thumbnail_job__isnull=True)
+        if not options['all']:
+            files = files.annotate(rendition_count=Count('renditions')) \
+                .filter(Q(rendition_count__lt=len(settings.PREVIEW_RENDITIONS)) | Q(phash__isnull=True))
+        jobs = ThumbnailJob.objects.bulk_create(
+            ThumbnailJob(file_id=file_hash) for file_hash in files.values_list('hash', flat=True)
+        )
+        self.stdout.write(f'Queued {len(jobs)} files.')
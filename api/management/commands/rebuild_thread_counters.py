@@ -0,0 +1,60 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Пересчитывает денормализованные счетчики и указатели тредов.
+"""
+
+from django.core.management import BaseCommand
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Post, Thread, touch_threads
+
+
+def rebuild_thread_counters(threads) -> int:
+    """
+    Пересчитывает ``post_count``, ``file_post_count``, ``op_post`` и ``last_post_id``
+    одним ``UPDATE`` с подзапросами.
+
+    :param threads: QuerySet тредов для пересчета.
+    :return: Количество обновленных тредов.
+    """
+    posts = Post.objects.filter(thread=OuterRef('pk')).order_by()
+    return threads.update(
+        post_count=Coalesce(Subquery(
+            posts.values('thread').annotate(count=Count('pk')).values('count')
+        ), 0),
+        file_post_count=Coalesce(Subquery(
+            posts.filter(files__isnull=False).values('thread')
+            .annotate(count=Count('pk', distinct=True)).values('count')
+        ), 0),
+        op_post=Subquery(posts.order_by('post_id').values('pk')[:1]),
+        last_post_id=Coalesce(Subquery(
+            posts.values('thread').annotate(last=Max('post_id')).values('last')
+        ), 0),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество постов, постов с файлами, ОП-пост и номер последнего поста тредов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('boards', nargs='*', metavar='board_name',
+                            help='Доски для пересчета (по умолчанию все).')
+
+    def handle(self, *args, **options):
+        threads = Thread.objects.all()
+        if options['boards']:
+            threads = threads.filter(board__board_name__in=options['boards'])
+        updated = rebuild_thread_counters(threads)
+        touch_threads(threads)
+        self.stdout.write(f'Rebuilt counters of {updated} threads.')
@@ -0,0 +1,28 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Выводит счетчики попаданий и промахов кэша ответов API.
+"""
+
+from django.core.management import BaseCommand
+
+from api.cache import get_stats
+
+
+class Command(BaseCommand):
+    help = 'Выводит счетчики попаданий и промахов кэша ответов API.'
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f'hits: {stats["hits"]}, misses: {stats["misses"]}, hit ratio: {ratio:.1%}')
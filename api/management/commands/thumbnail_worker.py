@@ -0,0 +1,73 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Пул процессов, создающих эскизы загруженных файлов.
+"""
+
+import logging
+import multiprocessing
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections, connections
+
+from api.media import process_next_thumbnail_job
+from gchan import settings
+
+log = logging.getLogger(__name__)
+
+
+def work(poll_interval: float, once: bool):
+    """
+    Цикл одного воркера: обрабатывает задачи, пока они есть, потом ждет новых.
+
+    :param poll_interval: Пауза между опросами пустой очереди, в секундах.
+    :param once: Выйти, когда очередь опустеет.
+    """
+    while True:
+        close_old_connections()
+        if process_next_thumbnail_job():
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Создает эскизы загруженных файлов из очереди в базе.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.THUMBNAIL_WORKERS,
+                            help='Количество процессов-воркеров.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, в секундах.')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать очередь и выйти.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            work(options['poll_interval'], options['once'])
+            return
+        connections.close_all()  # Соединения с базой не должны переходить в дочерние процессы
+        processes = [
+            multiprocessing.Process(target=work, args=(options['poll_interval'], options['once']), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        log.info('Started %d thumbnail workers.', len(processes))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
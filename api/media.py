@@ -0,0 +1,367 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Прием загруженных файлов: хэширование, определение типа, эскизы, сохранение.
+"""
+
+import hashlib
+import logging
+from io import BytesIO
+from typing import NamedTuple, Tuple
+
+from PIL import Image, ImageFilter
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from filetype import filetype
+from filetype.types import IMAGE, VIDEO
+
+from api.models import File, Rendition, Thread, ThumbnailJob, rendition_fname, touch_threads
+from api.phash import dhash
+from api.video import probe_video
+from gchan import settings
+
+log = logging.getLogger(__name__)
+
+MAX_THUMB_SIZE = 250
+# Во сколько раз картинка должна быть больше эскиза, чтобы сначала ужать ее фильтром BOX
+PRESHRINK_FACTOR = 3
+MAX_THUMBNAIL_ATTEMPTS = 3
+
+
+class UploadRejected(Exception):
+    """
+    Файл не принят. Текст исключения — причина для клиента.
+    """
+
+
+class IngestedUpload(NamedTuple):
+    """
+    Результат потокового приема файла.
+    """
+    file: UploadedFile
+    hash: str
+    fformat: object
+    size: int
+
+
+def ingest_upload(file: UploadedFile, max_file_size: int) -> IngestedUpload:
+    """
+    Читает файл по чанкам: считает SHA512, определяет тип по первому чанку
+    и прерывает чтение, как только превышен ``max_file_size``.
+    Содержимое целиком в память не читается.
+
+    :param file: Загруженный файл.
+    :param max_file_size: Максимальный размер в байтах.
+    :raise UploadRejected: Если файл слишком большой или неверного типа.
+    """
+    too_big = f'Файл слишком большой, максимальный размер: {max_file_size / 1024}KB'
+    if file.size is not None and file.size > max_file_size:
+        raise UploadRejected(too_big)
+    hasher = hashlib.sha512()
+    fformat = None
+    size = 0
+    for chunk in file.chunks():
+        if size == 0:
+            fformat = filetype.guess(chunk)
+            if fformat is None or not File.FileTypeEnum.has_value(fformat.EXTENSION):
+                raise UploadRejected(f'Файл неверного типа ({fformat.MIME if fformat is not None else "неизвестно"}),'
+                                     f' разрешены: {list(File.FileTypeEnum.list_values())} ')
+        size += len(chunk)
+        if size > max_file_size:
+            raise UploadRejected(too_big)
+        hasher.update(chunk)
+    if fformat is None:
+        raise UploadRejected('Пустой файл.')
+    file.seek(0)
+    return IngestedUpload(file, hasher.hexdigest(), fformat, size)
+
+
+def open_image(fp) -> Image.Image:
+    """
+    Открывает картинку, читая только заголовок, и проверяет,
+    что декодированные пиксели поместятся в ``THUMBNAIL_MAX_PIXELS``.
+
+    :param fp: Файл с картинкой.
+    :raise ValueError: Если картинка слишком большая.
+    :raise OSError: Если картинка не читается.
+    """
+    image = Image.open(fp)
+    if image.width * image.height > settings.THUMBNAIL_MAX_PIXELS:
+        raise ValueError(f'Картинка слишком большая: {image.width}x{image.height}')
+    return image
+
+
+def fit_size(width: int, height: int, max_side: int, upscale: bool = True) -> Tuple[int, int]:
+    """
+    Размер, вписанный в квадрат ``max_side`` с сохранением пропорций.
+
+    :param width: Исходная ширина.
+    :param height: Исходная высота.
+    :param max_side: Максимальная сторона.
+    :param upscale: Увеличивать ли картинки меньше ``max_side``.
+    """
+    resize_ratio = min(max_side / width, max_side / height)
+    if not upscale:
+        resize_ratio = min(resize_ratio, 1)
+    return max(int(width * resize_ratio), 1), max(int(height * resize_ratio), 1)
+
+
+def decode_for_previews(image: Image.Image, file_type: str, max_side: int) -> Image.Image:
+    """
+    Декодирует картинку один раз для всех эскизов, выбирая самый быстрый путь
+    для типа файла:
+
+    * JPEG сразу декодируется в уменьшенном в 2-8 раз масштабе (``draft``);
+    * у GIF и WebP декодируется только первый кадр анимации;
+    * большие картинки сначала дешево ужимаются фильтром BOX примерно
+      до удвоенного размера самого большого эскиза.
+
+    :param image: Открытая, но еще не декодированная картинка.
+    :param file_type: Значение ``File.FileTypeEnum``.
+    :param max_side: Большая сторона самого большого эскиза.
+    :return: Декодированная картинка в режиме RGB, RGBA или L.
+    """
+    size = fit_size(image.width, image.height, max_side)
+    if file_type == File.FileTypeEnum.JPEG.value:
+        image.draft('RGB', size)
+    elif file_type in (File.FileTypeEnum.GIF.value, File.FileTypeEnum.WEBP.value):
+        image.seek(0)
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if image.width >= size[0] * PRESHRINK_FACTOR and image.height >= size[1] * PRESHRINK_FACTOR:
+        image = image.resize((size[0] * 2, size[1] * 2), Image.BOX)
+    image.load()
+    return image
+
+
+def encode_preview(image: Image.Image, size: Tuple[int, int], fmt: str, quality: int,
+                   blur: float = 0) -> bytes:
+    """
+    Уменьшает декодированную картинку и кодирует ее.
+
+    :param image: Результат ``decode_for_previews``.
+    :param size: Размер эскиза.
+    :param fmt: Формат Pillow (``JPEG``, ``WEBP``...).
+    :param quality: Качество.
+    :param blur: Радиус размытия по Гауссу, ``0`` — без размытия.
+    """
+    preview = image.resize(size, Image.LANCZOS).convert('RGB')
+    if blur:
+        preview = preview.filter(ImageFilter.GaussianBlur(blur))
+    preview_bytes = BytesIO()
+    preview.save(preview_bytes, format=fmt, quality=quality)
+    return preview_bytes.getvalue()
+
+
+def make_thumbnail(image: Image.Image, file_type: str, quality: int) -> Tuple[int, int, bytes]:
+    """
+    Уменьшает картинку до ``MAX_THUMB_SIZE`` по большей стороне.
+
+    :param image: Открытая, но еще не декодированная картинка.
+    :param file_type: Значение ``File.FileTypeEnum``.
+    :param quality: Качество JPEG.
+    :return: Ширина, высота и JPEG-байты эскиза.
+    """
+    size = fit_size(image.width, image.height, MAX_THUMB_SIZE)
+    decoded = decode_for_previews(image, file_type, MAX_THUMB_SIZE)
+    return size[0], size[1], encode_preview(decoded, size, 'JPEG', quality)
+
+
+def store_upload(filename: str, file: UploadedFile, max_file_size: int) -> str:
+    """
+    Принимает файл, сохраняет его в хранилище и ставит в очередь задачу на эскиз.
+    Загруженный файл передается хранилищу как есть, без копирования в память.
+    Если такой файл уже есть, ничего не сохраняется.
+
+    :param filename: Имя файла.
+    :param file: Загруженный файл.
+    :param max_file_size: Максимальный размер в байтах.
+    :return: SHA512 хэш файла.
+    :raise UploadRejected: Если файл не прошел проверки.
+    """
+    upload = ingest_upload(file, max_file_size)
+    if File.objects.filter(hash=upload.hash).exists():
+        return upload.hash
+
+    width = height = 0
+    if upload.fformat in IMAGE:
+        try:
+            width, height = open_image(file).size
+        except ValueError as e:
+            raise UploadRejected(str(e))
+        except OSError:
+            raise UploadRejected('Не удалось прочитать картинку.')
+    elif upload.fformat not in VIDEO:
+        raise UploadRejected(f'Файл неверного типа ({upload.fformat.MIME})')
+
+    model_file = File(
+        hash=upload.hash,
+        filename=filename,
+        width=width,
+        height=height,
+        size=upload.size,
+        filetype=upload.fformat.EXTENSION,
+        status=File.StatusEnum.PENDING.value
+    )
+    model_file.content.save(f'c_{upload.hash}', file, save=False)
+    with transaction.atomic():
+        model_file.save()
+        job, _ = ThumbnailJob.objects.get_or_create(file=model_file)
+    if not settings.THUMBNAILS_IN_BACKGROUND:
+        run_thumbnail_job(job)
+    return upload.hash
+
+
+# Строк картинки, сравниваемых за раз в ``same_pixels``
+COMPARE_ROWS = 256
+
+
+def same_pixels(first: File, second: File) -> bool:
+    """
+    Совпадают ли картинки попиксельно: все кадры в полном размере.
+    Видео не сравниваются (совпадение первого кадра ничего не говорит об остальных).
+    """
+    if File.FileTypeEnum.WEBM.value in (first.filetype, second.filetype):
+        return False
+    with first.content.open('rb') as first_content, second.content.open('rb') as second_content:
+        images = open_image(first_content), open_image(second_content)
+        if images[0].size != images[1].size \
+                or getattr(images[0], 'n_frames', 1) != getattr(images[1], 'n_frames', 1):
+            return False
+        width, height = images[0].size
+        for frame in range(getattr(images[0], 'n_frames', 1)):
+            frames = []
+            for image in images:
+                image.seek(frame)
+                frames.append(image.convert('RGBA'))
+            # Полосами, чтобы не держать в памяти лишние копии большой картинки
+            for top in range(0, height, COMPARE_ROWS):
+                box = (0, top, width, min(top + COMPARE_ROWS, height))
+                if frames[0].crop(box).tobytes() != frames[1].crop(box).tobytes():
+                    return False
+    return True
+
+
+def reuse_similar_content(model_file: File, perceptual_hash: int):
+    """
+    Если уже есть готовый файл того же типа с тем же перцептивным хэшем и теми же
+    пикселями, ссылается на объект хранилища существующего файла, а только что сохраненный
+    контент удаляет после коммита (при откате файл остается со своим контентом).
+    Совпадение перцептивного хэша само по себе ничего не доказывает (например, один
+    шаблон мема с разными подписями), поэтому картинки сравниваются попиксельно: файл
+    отдает те же пиксели, что были загружены, хотя байты (и ``size``) — другого файла.
+
+    :param model_file: Обрабатываемый файл (ширина и высота уже посчитаны).
+    :param perceptual_hash: Его перцептивный хэш.
+    """
+    if not settings.PHASH_REUSE_CONTENT:
+        return
+    if File.objects.filter(content=model_file.content.name).exclude(pk=model_file.pk).exists():
+        return  # На этот контент уже ссылаются другие файлы
+    for _, similar in File.find_similar(perceptual_hash, 0):
+        if similar.pk == model_file.pk or similar.filetype != model_file.filetype \
+                or (similar.width, similar.height) != (model_file.width, model_file.height) \
+                or similar.status != File.StatusEnum.READY.value or not same_pixels(model_file, similar):
+            continue
+        log.info('Reusing content of %s for %s.', similar.pk, model_file.pk)
+        storage, name = model_file.content.storage, model_file.content.name
+        transaction.on_commit(lambda: storage.delete(name))
+        model_file.content.name = similar.content.name
+        model_file.size = similar.size
+        return
+
+
+def build_preview(model_file: File):
+    """
+    Создает эскиз и все варианты из ``PREVIEW_RENDITIONS`` за одно декодирование
+    сохраненного файла, считает перцептивный хэш и помечает файл готовым.
+
+    :param model_file: Файл.
+    """
+    renditions = settings.PREVIEW_RENDITIONS
+    max_side = max([MAX_THUMB_SIZE] + [rendition['size'] for rendition in renditions])
+    with model_file.content.open('rb') as content:
+        if model_file.filetype == File.FileTypeEnum.WEBM.value:
+            probe = probe_video(content)
+            image = probe.frame
+            model_file.frame_count = probe.frame_count
+            model_file.duration = probe.duration
+            quality = 85
+        else:
+            image = open_image(content)
+            quality = 70
+        model_file.width, model_file.height = image.size
+        decoded = decode_for_previews(image, model_file.filetype, max_side)
+    perceptual_hash = dhash(decoded)
+    model_file.set_phash(perceptual_hash)
+    reuse_similar_content(model_file, perceptual_hash)
+
+    thumbnail_size = fit_size(model_file.width, model_file.height, MAX_THUMB_SIZE)
+    model_file.thumbnailWidth, model_file.thumbnailHeight = thumbnail_size
+    model_file.preview_content.save(f'p_{model_file.hash}',
+                                    ContentFile(encode_preview(decoded, thumbnail_size, 'JPEG', quality)),
+                                    save=False)
+    model_file.status = File.StatusEnum.READY.value
+    model_file.save()
+
+    model_file.renditions.exclude(name__in=[rendition['name'] for rendition in renditions]).delete()
+    for rendition in renditions:
+        size = fit_size(model_file.width, model_file.height, rendition['size'], upscale=False)
+        data = encode_preview(decoded, size, rendition['format'], rendition['quality'], rendition.get('blur', 0))
+        model_rendition, _ = Rendition.objects.update_or_create(file=model_file, name=rendition['name'], defaults={
+            'format': rendition['format'],
+            'width': size[0],
+            'height': size[1],
+        })
+        model_rendition.content.save(rendition_fname(model_rendition, None), ContentFile(data))
+
+
+def run_thumbnail_job(job: ThumbnailJob):
+    """
+    Выполняет задачу на эскиз. При ошибке увеличивает счетчик попыток,
+    после ``MAX_THUMBNAIL_ATTEMPTS`` неудач помечает файл сломанным.
+
+    :param job: Задача.
+    """
+    # ``file_id`` — первичный ключ задачи, и ``delete()`` его обнуляет
+    file_id = job.file_id
+    try:
+        with transaction.atomic():
+            build_preview(job.file)
+            job.delete()
+    except Exception as e:
+        log.warning('Thumbnail job %s failed.', job, exc_info=True)
+        job.attempts += 1
+        job.error = repr(e)
+        job.save()
+        if job.attempts >= MAX_THUMBNAIL_ATTEMPTS:
+            File.objects.filter(pk=file_id).update(status=File.StatusEnum.FAILED.value)
+            touch_threads(Thread.objects.filter(posts__files=file_id))
+    else:
+        touch_threads(Thread.objects.filter(posts__files=file_id))
+
+
+def process_next_thumbnail_job() -> bool:
+    """
+    Забирает из очереди одну задачу и выполняет ее,
+    не блокируясь на задачах, которые уже взяли другие воркеры.
+
+    :return: Была ли в очереди задача.
+    """
+    with transaction.atomic():
+        job = ThumbnailJob.objects.select_for_update(skip_locked=True, of=('self',)).select_related('file') \
+            .filter(attempts__lt=MAX_THUMBNAIL_ATTEMPTS).first()
+        if job is None:
+            return False
+        run_thumbnail_job(job)
+    return True
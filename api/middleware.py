@@ -0,0 +1,147 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Сжатие JSON-ответов API.
+
+Сжимаются только ответы подходящего типа и размера (``COMPRESS_CONTENT_TYPES``,
+``COMPRESS_MIN_SIZE``): мелкие ответы сжатие только удлиняет, а картинки уже сжаты.
+Если установлен ``brotli`` и клиент его принимает, ответ сжимается им, иначе — gzip.
+Сжатые варианты закэшированных ответов тоже кэшируются (см. ``cached_json``),
+так что каждая версия ответа сжимается один раз.
+"""
+
+import logging
+from typing import Dict, Optional
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from api import cache
+from gchan import settings
+
+try:
+    import brotli
+except ImportError:  # brotli — необязательная зависимость
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Разбирает ``Accept-Encoding`` в словарь ``{кодировка: q}``.
+    """
+    encodings = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """
+    Выбирает кодировку для ответа: ``br``, ``gzip`` или ``None``.
+    Кодировки с ``q=0`` клиент явно запретил.
+    """
+    encodings = parse_accept_encoding(header)
+    wildcard = encodings.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    for encoding in candidates:
+        if encodings.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    """
+    Сжимает тело ответа.
+
+    :param content: Тело ответа.
+    :param encoding: ``br`` или ``gzip``.
+    """
+    if encoding == 'br':
+        return brotli.compress(content, mode=brotli.MODE_TEXT, quality=settings.COMPRESS_BROTLI_QUALITY)
+    return compress_string(content)
+
+
+def is_compressible(response: HttpResponse) -> bool:
+    """
+    Стоит ли сжимать ответ.
+    """
+    if response.streaming or response.status_code != 200 or response.has_header('Content-Encoding'):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type in settings.COMPRESS_CONTENT_TYPES and len(response.content) >= settings.COMPRESS_MIN_SIZE
+
+
+class CompressionMiddleware:
+    """
+    Сжимает JSON-ответы brotli или gzip в зависимости от ``Accept-Encoding``.
+    Стримы (SSE) не сжимаются: сжатие буферизует события.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_compressible(response):
+            return response
+
+        # Ответ зависит от Accept-Encoding, даже если этот клиент сжатие не принимает
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        content = self.get_compressed(response, encoding)
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # Сжатое тело отличается побайтово, но не по смыслу
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+    @staticmethod
+    def get_compressed(response: HttpResponse, encoding: str) -> bytes:
+        """
+        Сжимает тело ответа, используя сжатый вариант из кэша ответов, если он есть.
+        Сжатый вариант живет не дольше исходного ответа.
+        """
+        key = getattr(response, 'compression_cache_key', None)
+        if key is None:
+            return compress(response.content, encoding)
+
+        response_cache = cache.get_cache()
+        key = f'{key}:{encoding}'
+        content = response_cache.get(key)
+        if content is None:
+            content = compress(response.content, encoding)
+            response_cache.set(key, content, timeout=response.compression_cache_timeout)
+        return content
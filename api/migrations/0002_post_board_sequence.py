@@ -0,0 +1,69 @@
+# Generated by Django 2.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_post_board(apps, schema_editor):
+    """
+    Переносит доску из треда в каждый пост и выставляет счетчики номеров постов.
+    """
+    Board = apps.get_model('api', 'Board')
+    Post = apps.get_model('api', 'Post')
+    Thread = apps.get_model('api', 'Thread')
+    Post.objects.update(board_id=Subquery(Thread.objects.filter(pk=OuterRef('thread_id')).values('board_id')[:1]))
+    for board in Board.objects.all():
+        last_post_id = Post.objects.filter(board=board).aggregate(last=Max('post_id'))['last']
+        Board.objects.filter(pk=board.pk).update(last_post_id=last_post_id or 0)
+
+
+def renumber_duplicate_posts(apps, schema_editor):
+    """
+    Старый постинг мог выдать двум постам доски один номер. Самый ранний пост
+    сохраняет номер, остальные получают новые номера после ``last_post_id`` доски.
+    """
+    Board = apps.get_model('api', 'Board')
+    Post = apps.get_model('api', 'Post')
+    duplicates = Post.objects.values('board_id', 'post_id').annotate(count=Count('pk')).filter(count__gt=1)
+    for duplicate in list(duplicates):
+        board = Board.objects.get(pk=duplicate['board_id'])
+        posts = Post.objects.filter(board_id=duplicate['board_id'], post_id=duplicate['post_id']).order_by('pk')
+        for post in posts[1:]:
+            board.last_post_id += 1
+            Post.objects.filter(pk=post.pk).update(post_id=board.last_post_id)
+        board.save(update_fields=['last_post_id'])
+    # Иначе отложенные проверки внешних ключей не дадут изменить таблицу в этой же транзакции
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='last_post_id',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='последний номер поста'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='board',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='api.Board', verbose_name='доска'),
+        ),
+        migrations.RunPython(fill_post_board, migrations.RunPython.noop),
+        migrations.RunPython(renumber_duplicate_posts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='board',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='api.Board', verbose_name='доска'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='post',
+            unique_together={('board', 'post_id')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_post_board_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='preview_posts',
+            field=models.PositiveIntegerField(default=3, verbose_name='последних постов в превью треда'),
+        ),
+    ]
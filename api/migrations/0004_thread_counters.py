@@ -0,0 +1,55 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:38
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_thread_counters(apps, schema_editor):
+    """
+    Заполняет счетчики и указатели существующих тредов.
+    """
+    Post = apps.get_model('api', 'Post')
+    Thread = apps.get_model('api', 'Thread')
+    posts = Post.objects.filter(thread=OuterRef('pk')).order_by()
+    Thread.objects.update(
+        post_count=Coalesce(Subquery(posts.values('thread').annotate(count=Count('pk')).values('count')), 0),
+        file_post_count=Coalesce(Subquery(
+            posts.filter(files__isnull=False).values('thread').annotate(count=Count('pk', distinct=True))
+                .values('count')
+        ), 0),
+        op_post=Subquery(posts.order_by('post_id').values('pk')[:1]),
+        last_post_id=Coalesce(Subquery(posts.values('thread').annotate(last=Max('post_id')).values('last')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_board_preview_posts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='file_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='постов с файлами'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_post_id',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='номер последнего поста'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='op_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.Post', verbose_name='ОП-пост'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='постов'),
+        ),
+        migrations.RunPython(fill_thread_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:41
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_thread_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailJob',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='thumbnail_job', serialize=False, to='api.File', verbose_name='файл')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='попыток')),
+                ('error', models.TextField(blank=True, verbose_name='последняя ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='создана')),
+            ],
+            options={
+                'verbose_name': 'задача эскиза',
+                'verbose_name_plural': 'задачи эскизов',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='status',
+            field=models.CharField(choices=[('pending', 'PENDING'), ('ready', 'READY'), ('failed', 'FAILED')], default='ready', max_length=7, verbose_name='статус'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='height',
+            field=models.PositiveIntegerField(default=0, verbose_name='высота медиа'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='preview_content',
+            field=models.FileField(blank=True, max_length=256, upload_to=api.models.preview_fname, verbose_name='эскиз'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='thumbnailHeight',
+            field=models.PositiveIntegerField(default=0, verbose_name='высота эскиза'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='thumbnailWidth',
+            field=models.PositiveIntegerField(default=0, verbose_name='ширина эскиза'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='width',
+            field=models.PositiveIntegerField(default=0, verbose_name='ширина медиа'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_file_status_thumbnail_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='duration',
+            field=models.FloatField(blank=True, null=True, verbose_name='длительность (в секундах)'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='frame_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='количество кадров'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:44
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_file_video_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, verbose_name='название')),
+                ('format', models.CharField(max_length=8, verbose_name='формат')),
+                ('width', models.PositiveIntegerField(verbose_name='ширина')),
+                ('height', models.PositiveIntegerField(verbose_name='высота')),
+                ('content', models.FileField(max_length=256, upload_to=api.models.rendition_fname, verbose_name='содержимое')),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='api.File', verbose_name='файл')),
+            ],
+            options={
+                'verbose_name': 'вариант эскиза',
+                'verbose_name_plural': 'варианты эскизов',
+                'ordering': ['width'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='rendition',
+            unique_together={('file', 'name')},
+        ),
+    ]
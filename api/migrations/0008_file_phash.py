@@ -0,0 +1,38 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_rendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='phash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='перцептивный хэш'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='phash_0',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='phash_1',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='phash_2',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='phash_3',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+    ]
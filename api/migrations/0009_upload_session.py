@@ -0,0 +1,33 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_file_phash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=256, verbose_name='имя')),
+                ('size', models.PositiveIntegerField(verbose_name='размер')),
+                ('offset', models.PositiveIntegerField(default=0, verbose_name='принято байт')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='создана')),
+                ('expires_at', models.DateTimeField(verbose_name='истекает')),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='api.Board', verbose_name='доска')),
+            ],
+            options={
+                'verbose_name': 'сессия загрузки',
+                'verbose_name_plural': 'сессии загрузки',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='изменен'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_thread_modified_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['thread', 'post_id'], name='api_post_thread_post_id'),
+        ),
+    ]
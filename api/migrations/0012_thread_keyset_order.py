@@ -0,0 +1,21 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_post_thread_post_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='thread',
+            options={'ordering': ['-pinned', '-last_bump_time', '-id'], 'verbose_name': 'тред', 'verbose_name_plural': 'треды'},
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['board', '-pinned', '-last_bump_time', '-id'], name='api_thread_board_order'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_thread_keyset_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadSnapshot',
+            fields=[
+                ('thread', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='api.Thread', verbose_name='тред')),
+                ('header', models.BinaryField(verbose_name='JSON треда без постов')),
+                ('posts', models.BinaryField(verbose_name='JSON постов через запятую')),
+                ('modified_at', models.DateTimeField(verbose_name='версия треда')),
+            ],
+            options={
+                'verbose_name': 'снимок треда',
+                'verbose_name_plural': 'снимки тредов',
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 2.1.7 on 2026-10-18 12:04
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Вектор поста: тема важнее имени, имя важнее текста, текст важнее имен файлов.
+SEARCH_VECTOR_SQL = '''
+CREATE FUNCTION api_post_search_vector(post_pk integer, subject text, name text, body text) RETURNS tsvector
+LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce(subject, '')), 'A') ||
+           setweight(to_tsvector('russian', coalesce(name, '')), 'B') ||
+           setweight(to_tsvector('russian', coalesce(body, '')), 'C') ||
+           setweight(to_tsvector('russian', coalesce((
+               SELECT string_agg(f.filename, ' ')
+               FROM api_post_files pf JOIN api_file f ON f.hash = pf.file_id
+               WHERE pf.post_id = post_pk
+           ), '')), 'D')
+$$;
+
+CREATE FUNCTION api_post_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := api_post_search_vector(NEW.id, NEW.subject, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER api_post_search_vector_update BEFORE INSERT OR UPDATE OF subject, name, text ON api_post
+FOR EACH ROW EXECUTE PROCEDURE api_post_search_vector_trigger();
+
+CREATE FUNCTION api_post_files_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE api_post p SET search_vector = api_post_search_vector(p.id, p.subject, p.name, p.text)
+        WHERE p.id IN (SELECT post_id FROM new_rows);
+    ELSE
+        UPDATE api_post p SET search_vector = api_post_search_vector(p.id, p.subject, p.name, p.text)
+        WHERE p.id IN (SELECT post_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER api_post_files_search_vector_insert AFTER INSERT ON api_post_files
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE api_post_files_search_vector_trigger();
+
+CREATE TRIGGER api_post_files_search_vector_delete AFTER DELETE ON api_post_files
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE api_post_files_search_vector_trigger();
+
+CREATE FUNCTION api_file_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE api_post p SET search_vector = api_post_search_vector(p.id, p.subject, p.name, p.text)
+    WHERE p.id IN (SELECT post_id FROM api_post_files WHERE file_id = NEW.hash);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER api_file_search_vector_update AFTER UPDATE OF filename ON api_file
+FOR EACH ROW WHEN (OLD.filename IS DISTINCT FROM NEW.filename)
+EXECUTE PROCEDURE api_file_search_vector_trigger();
+
+UPDATE api_post SET search_vector = api_post_search_vector(id, subject, name, text);
+'''
+
+DROP_SEARCH_VECTOR_SQL = '''
+DROP TRIGGER api_file_search_vector_update ON api_file;
+DROP FUNCTION api_file_search_vector_trigger();
+DROP TRIGGER api_post_files_search_vector_delete ON api_post_files;
+DROP TRIGGER api_post_files_search_vector_insert ON api_post_files;
+DROP FUNCTION api_post_files_search_vector_trigger();
+DROP TRIGGER api_post_search_vector_update ON api_post;
+DROP FUNCTION api_post_search_vector_trigger();
+DROP FUNCTION api_post_search_vector(integer, text, text, text);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_thread_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='поисковый вектор'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, DROP_SEARCH_VECTOR_SQL),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='api_post_search_vector'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.1.7 on 2026-10-18 12:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_snapshots(apps, schema_editor):
+    """
+    Удаляет снимки в старом формате: они пересоберутся при следующем чтении треда.
+    """
+    apps.get_model('api', 'ThreadSnapshot').objects.all().delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_snapshots, delete_snapshots),
+        migrations.CreateModel(
+            name='ThreadSnapshotChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='номер части')),
+                ('posts', models.BinaryField(verbose_name='JSON постов через запятую')),
+                ('post_count', models.PositiveIntegerField(verbose_name='количество постов')),
+            ],
+            options={
+                'verbose_name': 'часть снимка треда',
+                'verbose_name_plural': 'части снимков тредов',
+                'ordering': ['number'],
+            },
+        ),
+        migrations.RemoveField(
+            model_name='threadsnapshot',
+            name='posts',
+        ),
+        migrations.AddField(
+            model_name='threadsnapshotchunk',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.ThreadSnapshot', verbose_name='снимок'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='threadsnapshotchunk',
+            unique_together={('snapshot', 'number')},
+        ),
+    ]
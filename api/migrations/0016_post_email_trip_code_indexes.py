@@ -0,0 +1,21 @@
+# Generated by Django 2.1.7 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_thread_snapshot_chunks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['email'], name='api_post_email'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['trip_code'], name='api_post_trip_code'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.7 on 2026-10-18 15:40
+
+import datetime
+
+from django.db import migrations, models
+from django.utils.timezone import utc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_post_email_trip_code_indexes'),
+    ]
+
+    operations = [
+        # Время сборки старых снимков неизвестно: они пересоберутся при следующем чтении
+        migrations.AddField(
+            model_name='threadsnapshot',
+            name='built_at',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1, 0, 0, tzinfo=utc), verbose_name='время сборки'),
+            preserve_default=False,
+        ),
+    ]
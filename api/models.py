@@ -13,12 +13,26 @@
 Описание моделей борды.
 """
 
+import logging
+import os
+import uuid
 from enum import Enum
+from typing import List, Tuple
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 
+from api.cache import board_scope, bump, invalidate_threads, thread_scope
+from api.phash import MAX_INDEXED_DISTANCE, distance, split, to_signed
+from gchan import settings
+
+log = logging.getLogger(__name__)
+
+THREADS_PER_PAGE = 10
+
 
 # noinspection PyUnusedLocal
 def content_fname(model, fname):
@@ -36,6 +50,14 @@ def preview_fname(model, fname):
     return f'p_{model.hash}'
 
 
+# noinspection PyUnusedLocal
+def rendition_fname(model, fname):
+    """
+    Имя файла из префикса ``r_``, хэша и названия варианта.
+    """
+    return f'r_{model.file_id}_{model.name}'
+
+
 class File(models.Model):
     """
     Хранит в себе информацию о файле и прямую ссылку
@@ -71,23 +93,77 @@ class File(models.Model):
             """
             return [item.value for item in cls]
 
+    class StatusEnum(Enum):
+        """
+        Состояние обработки файла.
+        """
+        PENDING = 'pending'
+        READY = 'ready'
+        FAILED = 'failed'
+
     hash = models.CharField('SHA512', max_length=128, primary_key=True)
     filename = models.CharField('имя', max_length=256)
-    width = models.PositiveIntegerField('ширина медиа')
-    height = models.PositiveIntegerField('высота медиа')
+    width = models.PositiveIntegerField('ширина медиа', default=0)
+    height = models.PositiveIntegerField('высота медиа', default=0)
     size = models.PositiveIntegerField('размер')
 
     content = models.FileField('содержимое', upload_to=content_fname, max_length=256)
-    preview_content = models.FileField('эскиз', upload_to=preview_fname, max_length=256)
+    preview_content = models.FileField('эскиз', upload_to=preview_fname, max_length=256, blank=True)
 
-    thumbnailWidth = models.PositiveIntegerField('ширина эскиза')
-    thumbnailHeight = models.PositiveIntegerField('высота эскиза')
+    thumbnailWidth = models.PositiveIntegerField('ширина эскиза', default=0)
+    thumbnailHeight = models.PositiveIntegerField('высота эскиза', default=0)
     filetype = models.CharField('тип', max_length=4,
                                 choices=[(tag.name, tag.value) for tag in FileTypeEnum])
+    status = models.CharField('статус', max_length=7, default=StatusEnum.READY.value,
+                              choices=[(tag.value, tag.name) for tag in StatusEnum])
+
+    duration = models.FloatField('длительность (в секундах)', null=True, blank=True)
+    frame_count = models.PositiveIntegerField('количество кадров', null=True, blank=True)
+
+    # Перцептивный хэш и его части для поиска похожих (см. ``api.phash``)
+    phash = models.BigIntegerField('перцептивный хэш', null=True, blank=True, editable=False)
+    phash_0 = models.PositiveIntegerField(null=True, db_index=True, editable=False)
+    phash_1 = models.PositiveIntegerField(null=True, db_index=True, editable=False)
+    phash_2 = models.PositiveIntegerField(null=True, db_index=True, editable=False)
+    phash_3 = models.PositiveIntegerField(null=True, db_index=True, editable=False)
 
     created_at = models.DateTimeField('создан', editable=False)
     modified_at = models.DateTimeField('изменен', blank=True, editable=False)
 
+    def set_phash(self, value: int):
+        """
+        Запоминает перцептивный хэш вместе с его частями.
+
+        :param value: Хэш без знака.
+        """
+        self.phash = to_signed(value)
+        self.phash_0, self.phash_1, self.phash_2, self.phash_3 = split(value)
+
+    @classmethod
+    def find_similar(cls, value: int, max_distance: int) -> List[Tuple[int, 'File']]:
+        """
+        Ищет файлы с перцептивным хэшем не дальше ``max_distance`` бит от ``value``.
+        Кандидаты выбираются по индексам частей хэша, расстояние считается только для них.
+
+        :param value: Хэш без знака.
+        :param max_distance: Максимальное расстояние Хэмминга,
+            не больше ``api.MAX_INDEXED_DISTANCE``.
+        :return: Пары (расстояние, файл), ближайшие первыми.
+        """
+        if not 0 <= max_distance <= MAX_INDEXED_DISTANCE:
+            raise ValueError(f'max_distance must be in 0..{MAX_INDEXED_DISTANCE}')
+        parts = split(value)
+        query = models.Q()
+        for i, part in enumerate(parts):
+            query |= models.Q(**{f'phash_{i}': part})
+        result = []
+        for file in cls.objects.filter(query):
+            file_distance = distance(value, file.phash)
+            if file_distance <= max_distance:
+                result.append((file_distance, file))
+        result.sort(key=lambda item: item[0])
+        return result
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         """
@@ -102,6 +178,82 @@ class File(models.Model):
         return f'{self.filename} <{self.hash}> {self.width}x{self.height}'
 
 
+class Rendition(models.Model):
+    """
+    Вариант эскиза файла: размер и формат задаются в ``PREVIEW_RENDITIONS``.
+    """
+
+    class Meta:
+        ordering = ['width', ]
+        unique_together = ('file', 'name',)
+        verbose_name = 'вариант эскиза'
+        verbose_name_plural = 'варианты эскизов'
+
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='renditions', verbose_name='файл')
+    name = models.CharField('название', max_length=32)
+    format = models.CharField('формат', max_length=8)
+    width = models.PositiveIntegerField('ширина')
+    height = models.PositiveIntegerField('высота')
+    content = models.FileField('содержимое', upload_to=rendition_fname, max_length=256)
+
+    def __str__(self):
+        return f'{self.name} {self.width}x{self.height} {self.format}'
+
+
+class ThumbnailJob(models.Model):
+    """
+    Задача на создание эскиза файла.
+    Очередь лежит в базе: воркеры (``manage.py thumbnail_worker``) забирают задачи
+    через ``SELECT ... FOR UPDATE SKIP LOCKED`` и держат блокировку до конца обработки,
+    так что задачу упавшего воркера подхватит другой.
+    """
+
+    class Meta:
+        ordering = ['created_at', ]
+        verbose_name = 'задача эскиза'
+        verbose_name_plural = 'задачи эскизов'
+
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='thumbnail_job',
+                                verbose_name='файл', primary_key=True)
+    attempts = models.PositiveIntegerField('попыток', default=0)
+    error = models.TextField('последняя ошибка', blank=True)
+    created_at = models.DateTimeField('создана', default=timezone.now, editable=False)
+
+    def __str__(self):
+        return f'{self.file_id} ({self.attempts})'
+
+
+class UploadSession(models.Model):
+    """
+    Сессия загрузки файла по частям.
+    Принятые части дописываются в файл ``spool_path`` в ``UPLOAD_SPOOL_DIR``.
+    """
+
+    class Meta:
+        ordering = ['created_at', ]
+        verbose_name = 'сессия загрузки'
+        verbose_name_plural = 'сессии загрузки'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    board = models.ForeignKey('Board', on_delete=models.CASCADE, related_name='upload_sessions',
+                              verbose_name='доска')
+    filename = models.CharField('имя', max_length=256)
+    size = models.PositiveIntegerField('размер')
+    offset = models.PositiveIntegerField('принято байт', default=0)
+    created_at = models.DateTimeField('создана', default=timezone.now, editable=False)
+    expires_at = models.DateTimeField('истекает')
+
+    @property
+    def spool_path(self) -> str:
+        """
+        Путь к файлу с уже принятыми частями.
+        """
+        return os.path.join(settings.UPLOAD_SPOOL_DIR, str(self.id))
+
+    def __str__(self):
+        return f'{self.filename} {self.offset}/{self.size}'
+
+
 class Post(models.Model):
     """
     Хранит в себе всю информацию о конкретном посте.
@@ -109,11 +261,22 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['post_id', ]
+        unique_together = ('board', 'post_id',)
+        indexes = [
+            models.Index(fields=['thread', 'post_id'], name='api_post_thread_post_id'),
+            GinIndex(fields=['search_vector'], name='api_post_search_vector'),
+            # Точный поиск в админке (см. ``api.admin.PostSearchMixin``)
+            models.Index(fields=['email'], name='api_post_email'),
+            models.Index(fields=['trip_code'], name='api_post_trip_code'),
+        ]
         verbose_name = 'пост'
         verbose_name_plural = 'посты'
 
     thread = models.ForeignKey('Thread', on_delete=models.CASCADE, related_name='posts',
                                verbose_name='тред', null=False, blank=False)
+    # Денормализовано из ``thread.board`` ради уникального индекса (доска, номер поста).
+    board = models.ForeignKey('Board', on_delete=models.CASCADE, related_name='posts',
+                              verbose_name='доска', editable=False)
 
     post_id = models.PositiveIntegerField('ID')
     banned = models.BooleanField('забанен?', default=False)
@@ -126,6 +289,9 @@ class Post(models.Model):
     op = models.BooleanField('ОП-флажок', default=False)
 
     files = models.ManyToManyField(File, verbose_name='файлы', blank=True)
+    # Тема, имя, текст и имена файлов для полнотекстового поиска (см. ``api.queries.search_posts``).
+    # Заполняется триггерами базы (миграция ``0014_post_search_vector``), а не Django.
+    search_vector = SearchVectorField('поисковый вектор', null=True, editable=False)
 
     created_at = models.DateTimeField('создан', editable=False)
     modified_at = models.DateTimeField('изменен', blank=True, editable=False)
@@ -133,15 +299,21 @@ class Post(models.Model):
     def validate_unique(self, exclude=None):
         """
         Проверяет, нет ли на одной доске постов с одинаковыми ``post_id``.
+        Обычно это делает ``unique_together``, но формы админки исключают
+        нередактируемое поле ``board``, и тогда проверка делается здесь
+        одним запросом по тому же индексу.
         """
-        if exclude is not None and 'thread' in exclude:
-            return super().validate_unique(exclude)  # early return
-        for post in Post.objects.all():
-            if post.post_id == self.post_id and post.thread.board.board_name == self.thread.board.board_name:
-                if post.pk == self.pk:
-                    continue
-                raise ValidationError({'post_id': ['Post ID must be unique per board', ], })
-        return super().validate_unique(exclude)
+        super().validate_unique(exclude)
+        if exclude is None or 'board' not in exclude or 'post_id' in exclude:
+            return
+        if self.board_id is not None:
+            board_id = self.board_id
+        elif self.thread_id is not None:
+            board_id = self.thread.board_id
+        else:
+            return
+        if Post.objects.filter(board_id=board_id, post_id=self.post_id).exclude(pk=self.pk).exists():
+            raise ValidationError({'post_id': ['Post ID must be unique per board', ], })
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -151,6 +323,8 @@ class Post(models.Model):
         if not self.created_at:
             self.created_at = timezone.now()
         self.modified_at = timezone.now()
+        if self.board_id is None:
+            self.board_id = self.thread.board_id
         # self.validate_unique()
         return super().save(force_insert, force_update, using, update_fields)
 
@@ -165,7 +339,10 @@ class Thread(models.Model):
     """
 
     class Meta:
-        ordering = ['-pinned', '-last_bump_time']
+        ordering = ['-pinned', '-last_bump_time', '-id']
+        indexes = [
+            models.Index(fields=['board', '-pinned', '-last_bump_time', '-id'], name='api_thread_board_order'),
+        ]
         verbose_name = 'тред'
         verbose_name_plural = 'треды'
 
@@ -175,8 +352,92 @@ class Thread(models.Model):
                               verbose_name='доска', null=False, blank=False)
     last_bump_time = models.DateTimeField('последний бамп', default=timezone.now)
 
+    # Счетчики и указатели поддерживаются при постинге (см. ``add_post``),
+    # пересчитываются командой ``rebuild_thread_counters``.
+    post_count = models.PositiveIntegerField('постов', default=0, editable=False)
+    file_post_count = models.PositiveIntegerField('постов с файлами', default=0, editable=False)
+    op_post = models.ForeignKey('Post', on_delete=models.SET_NULL, related_name='+',
+                                verbose_name='ОП-пост', null=True, blank=True, editable=False)
+    last_post_id = models.PositiveIntegerField('номер последнего поста', default=0, editable=False)
+    # Меняется с любым изменением треда или его постов (см. ``touch_threads``).
+    modified_at = models.DateTimeField('изменен', default=timezone.now, editable=False)
+
+    def add_post(self, post: Post, with_files: bool):
+        """
+        Учитывает новый пост в счетчиках треда.
+        Строка треда остается заблокированной до конца транзакции,
+        поэтому вызывать нужно внутри ``transaction.atomic()``.
+
+        :param post: Новый пост.
+        :param with_files: Есть ли у поста файлы.
+        """
+        fields = {
+            'post_count': models.F('post_count') + 1,
+            'file_post_count': models.F('file_post_count') + int(with_files),
+            'last_post_id': post.post_id,
+            'modified_at': timezone.now(),
+        }
+        if self.op_post_id is None:
+            fields['op_post'] = post
+        Thread.objects.filter(pk=self.pk).update(**fields)
+        self.refresh_from_db(fields=['post_count', 'file_post_count', 'op_post', 'last_post_id', 'modified_at'])
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        """
+        Указывает дату-время изменения (даже при сохранении части полей).
+        """
+        self.modified_at = timezone.now()
+        if update_fields is not None and 'modified_at' not in update_fields:
+            update_fields = list(update_fields) + ['modified_at']
+        return super().save(force_insert, force_update, using, update_fields)
+
+    def __str__(self):
+        return f'#{self.pk} ({self.op_post})'
+
+
+class ThreadSnapshot(models.Model):
+    """
+    Готовый JSON треда (см. ``api.snapshots``): заголовок треда и посты хранятся
+    отдельно, а посты — частями (``ThreadSnapshotChunk``), чтобы новый пост дописывался
+    в последнюю часть без пересборки и перезаписи всего треда.
+    Снимок актуален, пока ``modified_at`` совпадает с ``Thread.modified_at``
+    и ссылки на файлы в нем не старше ``SNAPSHOT_MAX_AGE`` (``built_at``).
+    """
+
+    class Meta:
+        verbose_name = 'снимок треда'
+        verbose_name_plural = 'снимки тредов'
+
+    thread = models.OneToOneField('Thread', on_delete=models.CASCADE, related_name='snapshot',
+                                  verbose_name='тред', primary_key=True)
+    header = models.BinaryField('JSON треда без постов')
+    modified_at = models.DateTimeField('версия треда')
+    built_at = models.DateTimeField('время сборки')
+
     def __str__(self):
-        return f'#{self.pk} ({self.posts.first()})'
+        return f'{self.thread_id} ({self.modified_at})'
+
+
+class ThreadSnapshotChunk(models.Model):
+    """
+    Часть постов снимка треда: JSON нескольких постов подряд через запятую.
+    """
+
+    class Meta:
+        ordering = ['number', ]
+        unique_together = ('snapshot', 'number',)
+        verbose_name = 'часть снимка треда'
+        verbose_name_plural = 'части снимков тредов'
+
+    snapshot = models.ForeignKey('ThreadSnapshot', on_delete=models.CASCADE, related_name='chunks',
+                                 verbose_name='снимок')
+    number = models.PositiveIntegerField('номер части')
+    posts = models.BinaryField('JSON постов через запятую')
+    post_count = models.PositiveIntegerField('количество постов')
+
+    def __str__(self):
+        return f'{self.snapshot_id} #{self.number}'
 
 
 class Board(models.Model):
@@ -195,12 +456,42 @@ class Board(models.Model):
     default_name = models.CharField('имя по умолчанию', max_length=64)
     max_file_size = models.PositiveIntegerField('максимальный размер файла (в КБ)')
     max_text_size = models.PositiveIntegerField('максимальное количество символов')
+    preview_posts = models.PositiveIntegerField('последних постов в превью треда', default=3)
 
     closed = models.BooleanField('закрыта?')
 
+    last_post_id = models.PositiveIntegerField('последний номер поста', default=0, editable=False)
+
     created_at = models.DateTimeField('создана', editable=False)
     modified_at = models.DateTimeField('изменена', blank=True, editable=False)
 
+    def reserve_post_id(self) -> int:
+        """
+        Атомарно резервирует следующий номер поста на доске.
+        Строка доски остается заблокированной до конца транзакции,
+        поэтому вызывать нужно внутри ``transaction.atomic()``.
+
+        :return: Зарезервированный номер поста.
+        """
+        Board.objects.filter(pk=self.pk).update(last_post_id=models.F('last_post_id') + 1, modified_at=timezone.now())
+        self.last_post_id = Board.objects.values_list('last_post_id', flat=True).get(pk=self.pk)
+        return self.last_post_id
+
+    def prune_threads(self) -> List[int]:
+        """
+        Удаляет треды, не помещающиеся на страницы доски: находит их одним
+        упорядоченным запросом и удаляет вместе с постами одним каскадным удалением.
+
+        :return: ``pk`` удаленных тредов.
+        """
+        overflow = list(self.threads.values_list('pk', flat=True)[THREADS_PER_PAGE * self.pages:])
+        if overflow:
+            _, deleted = Thread.objects.filter(pk__in=overflow).delete()
+            Board.objects.filter(pk=self.pk).update(modified_at=timezone.now())
+            bump(board_scope(self.board_name), *[thread_scope(thread_pk) for thread_pk in overflow])
+            log.info('Pruned /%s/: %s', self.board_name, deleted)
+        return overflow
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         """
@@ -213,3 +504,17 @@ class Board(models.Model):
 
     def __str__(self):
         return f'/{self.board_name}/ ({self.description})'
+
+
+def touch_threads(threads):
+    """
+    Отмечает изменение тредов и их досок, сделанное в обход ``save``
+    (правки в админке, готовый эскиз файла): обновляет ``modified_at``
+    и сбрасывает кэш ответов.
+
+    :param threads: ``QuerySet`` тредов.
+    """
+    now = timezone.now()
+    invalidate_threads(threads)
+    Board.objects.filter(threads__in=threads).update(modified_at=now)
+    Thread.objects.filter(pk__in=threads.values('pk')).update(modified_at=now)
@@ -0,0 +1,75 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Перцептивный хэш (dHash) картинок для поиска почти одинаковых файлов.
+
+64-битный хэш режется на ``PHASH_PARTS`` частей по 16 бит, каждая хранится
+в отдельной индексированной колонке. Если два хэша отличаются не больше чем
+в ``PHASH_PARTS - 1`` битах, то хотя бы одна часть у них совпадает целиком
+(принцип Дирихле), поэтому кандидатов можно искать по индексам, а точное
+расстояние считать только для них.
+"""
+
+from typing import Tuple
+
+from PIL import Image
+
+PHASH_PARTS = 4
+PHASH_PART_BITS = 64 // PHASH_PARTS
+MAX_INDEXED_DISTANCE = PHASH_PARTS - 1
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Разностный хэш: картинка ужимается до 9x8 в оттенках серого,
+    каждый бит — ярче ли пиксель своего соседа справа.
+
+    :param image: Декодированная картинка.
+    :return: Хэш без знака, 64 бита.
+    """
+    pixels = list(image.convert('L').resize((9, 8), Image.BOX).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value: int) -> int:
+    """
+    Хэш без знака в знаковое 64-битное число для ``BigIntegerField``.
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value: int) -> int:
+    """
+    Обратное к ``to_signed``.
+    """
+    return value + (1 << 64) if value < 0 else value
+
+
+def split(value: int) -> Tuple[int, ...]:
+    """
+    Части хэша для индексированных колонок, от старших битов к младшим.
+
+    :param value: Хэш без знака.
+    """
+    mask = (1 << PHASH_PART_BITS) - 1
+    return tuple((value >> (PHASH_PART_BITS * (PHASH_PARTS - 1 - i))) & mask for i in range(PHASH_PARTS))
+
+
+def distance(a: int, b: int) -> int:
+    """
+    Расстояние Хэмминга между двумя хэшами.
+    """
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
@@ -0,0 +1,193 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Запросы, которые неудобно выражать через ORM.
+"""
+
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, prefetch_related_objects
+from django.db.models.functions import Substr
+from django.utils.dateparse import parse_datetime
+from rest_framework.fields import DateTimeField
+
+from api.fast_serializers import serialize_posts
+from api.models import Board, File, Post, Thread, THREADS_PER_PAGE
+
+PREVIEW_POSTS_SQL = f'''
+SELECT * FROM (
+    SELECT p.*,
+           row_number() OVER (PARTITION BY p.thread_id ORDER BY p.post_id) AS rn_first,
+           row_number() OVER (PARTITION BY p.thread_id ORDER BY p.post_id DESC) AS rn_last
+    FROM {Post._meta.db_table} p
+    WHERE p.thread_id = ANY(%s)
+) p
+WHERE p.rn_first = 1 OR p.rn_last <= %s
+ORDER BY p.thread_id, p.post_id
+'''
+
+# Сравнение кортежей идет одним диапазоном по индексу ``api_thread_board_order``,
+# а эквивалентное условие из Q (через OR) планировщик так не использует.
+THREADS_AFTER_SQL = f'({Thread._meta.db_table}.pinned, {Thread._meta.db_table}.last_bump_time, ' \
+                    f'{Thread._meta.db_table}.id) < (%s, %s, %s)'
+
+CATALOG_SNIPPET_LENGTH = 150
+
+# Конфигурация должна совпадать с той, которой триггеры строят ``Post.search_vector``
+SEARCH_CONFIG = 'russian'
+SEARCH_RESULTS_PER_PAGE = 20
+
+
+def get_preview_posts(threads: Iterable[Thread], count: int) -> Dict[int, List[Post]]:
+    """
+    Достает ОП-пост и ``count`` последних ответов для каждого треда
+    одним запросом (плюс запросы на файлы и их варианты эскизов), независимо от количества тредов.
+
+    :param threads: Треды страницы.
+    :param count: Количество последних ответов.
+    :return: Посты каждого треда по возрастанию номера, ключ — ``pk`` треда.
+    """
+    thread_ids = [thread.pk for thread in threads]
+    if not thread_ids:
+        return {}
+    posts = list(Post.objects.raw(PREVIEW_POSTS_SQL, [thread_ids, count]))
+    prefetch_related_objects(posts, 'files', 'files__renditions')
+    result = defaultdict(list)
+    for post in posts:
+        result[post.thread_id].append(post)
+    return result
+
+
+def encode_cursor(thread: Thread) -> str:
+    """
+    Курсор, указывающий на место сразу после треда в порядке ``Thread.Meta.ordering``.
+    """
+    raw = json.dumps([thread.pinned, thread.last_bump_time.isoformat(), thread.pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, datetime, int]:
+    """
+    Разбирает курсор из ``encode_cursor``.
+
+    :raise ValueError: Если курсор неверный.
+    """
+    try:
+        pinned, last_bump_time, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        last_bump_time = parse_datetime(last_bump_time)
+    except (TypeError, ValueError):
+        raise ValueError('Неверный курсор.')
+    # pk — AutoField: число вне integer сломало бы запрос
+    if not isinstance(pinned, bool) or last_bump_time is None or not isinstance(pk, int) or not 0 < pk < 2 ** 31:
+        raise ValueError('Неверный курсор.')
+    return pinned, last_bump_time, pk
+
+
+def get_threads_after(board: Board, after: Optional[Tuple[bool, datetime, int]],
+                      count: int) -> Tuple[List[Thread], Optional[str]]:
+    """
+    Keyset-пагинация тредов доски: тред, поднятый бампом во время листания,
+    не повторится на следующей странице и не сдвинет остальные, а глубина
+    страницы не влияет на стоимость запроса.
+
+    :param board: Доска.
+    :param after: Разобранный ``decode_cursor`` курсор из предыдущего ответа
+        или ``None`` для первой страницы.
+    :param count: Количество тредов на странице.
+    :return: Треды страницы и курсор следующей страницы (``None``, если она пуста).
+    """
+    threads = board.threads.all()
+    if after is not None:
+        threads = threads.extra(where=[THREADS_AFTER_SQL], params=after)
+    threads = list(threads[:count + 1])  # Лишний тред показывает, есть ли следующая страница
+    if len(threads) <= count:
+        return threads, None
+    return threads[:count], encode_cursor(threads[count - 1])
+
+
+def get_catalog(board: Board) -> List[Dict]:
+    """
+    Каталог доски: все живые треды с кратким ОП-постом и его первым эскизом.
+    Строится двумя запросами ``values()`` без создания моделей и сериализаторов,
+    а текст ОП-поста обрезается прямо в базе.
+
+    :param board: Доска.
+    :return: Треды в порядке ``Thread.Meta.ordering``.
+    """
+    threads = list(board.threads.values(
+        'pinned', 'closed', 'post_count', 'file_post_count', 'last_bump_time', 'op_post_id',
+        'op_post__post_id', 'op_post__subject', 'op_post__name', 'op_post__created_at',
+    ).annotate(snippet=Substr('op_post__text', 1, CATALOG_SNIPPET_LENGTH))[:board.pages * THREADS_PER_PAGE])
+
+    thumbnails = {}
+    post_files = Post.files.through.objects \
+        .filter(post_id__in=[thread['op_post_id'] for thread in threads]) \
+        .values_list('post_id', 'file__preview_content', 'file__thumbnailWidth', 'file__thumbnailHeight') \
+        .order_by('pk')
+    storage = File._meta.get_field('preview_content').storage
+    for post_id, preview, width, height in post_files:
+        if post_id not in thumbnails and preview:
+            thumbnails[post_id] = {'url': storage.url(preview), 'width': width, 'height': height}
+
+    datetime_field = DateTimeField()  # Тот же формат дат, что и в сериализаторах
+    return [{
+        'thread': thread['op_post_id'],
+        'post_id': thread['op_post__post_id'],
+        'subject': thread['op_post__subject'],
+        'name': thread['op_post__name'],
+        'snippet': thread['snippet'],
+        'created_at': datetime_field.to_representation(thread['op_post__created_at']),
+        'last_bump_time': datetime_field.to_representation(thread['last_bump_time']),
+        'pinned': thread['pinned'],
+        'closed': thread['closed'],
+        'post_count': thread['post_count'],
+        'file_post_count': thread['file_post_count'],
+        'thumbnail': thumbnails.get(thread['op_post_id']),
+    } for thread in threads]
+
+
+def search_posts(query: str, board: Optional[Board], page: int) -> Tuple[List[Dict], bool]:
+    """
+    Полнотекстовый поиск постов по GIN-индексу ``Post.search_vector``.
+    Сначала идут совпадения в теме, затем в имени, тексте и именах файлов.
+
+    :param query: Поисковый запрос (слова, как их пишет пользователь).
+    :param board: Доска или ``None`` для поиска по всем доскам.
+    :param page: Номер страницы, начиная с 1.
+    :return: Посты страницы (как ``PostSerializer`` плюс доска и тред) и есть ли следующая страница.
+    """
+    search_query = SearchQuery(query, config=SEARCH_CONFIG)
+    posts = Post.objects.filter(search_vector=search_query)
+    if board is not None:
+        posts = posts.filter(board=board)
+    offset = (page - 1) * SEARCH_RESULTS_PER_PAGE
+    # Лишняя строка показывает, есть ли следующая страница, без подсчета всех совпадений
+    rows = list(posts.annotate(rank=SearchRank(F('search_vector'), search_query))
+                .order_by('-rank', '-pk')
+                .values_list('pk', 'board__board_name', 'thread__op_post')[offset:offset + SEARCH_RESULTS_PER_PAGE + 1])
+    has_next = len(rows) > SEARCH_RESULTS_PER_PAGE
+    rows = rows[:SEARCH_RESULTS_PER_PAGE]
+
+    pks = sorted(row[0] for row in rows)
+    serialized = dict(zip(pks, serialize_posts(Post.objects.filter(pk__in=pks).order_by('pk'))))
+    results = []
+    for pk, board_name, thread in rows:
+        post = serialized[pk]
+        post['board'] = board_name
+        post['thread'] = thread
+        results.append(post)
+    return results, has_next
@@ -15,18 +15,29 @@ JSON-сериализаторы.
 
 from rest_framework import serializers
 
-from api.models import Post, File, Thread, Board
+from api.models import Post, File, Thread, Board, Rendition
+
+
+class RenditionSerializer(serializers.ModelSerializer):
+    """
+    Сериализует вариант эскиза.
+    """
+
+    class Meta:
+        model = Rendition
+        exclude = ('id', 'file',)
 
 
 class FileSerializer(serializers.ModelSerializer):
     """
     Сериализует информацию о файле, вместе
-    с прямыми ссылками на эскиз и контент.
+    с прямыми ссылками на эскиз, его варианты и контент.
     """
+    renditions = RenditionSerializer(many=True, read_only=True)
 
     class Meta:
         model = File
-        exclude = ('modified_at',)
+        exclude = ('modified_at', 'phash', 'phash_0', 'phash_1', 'phash_2', 'phash_3',)
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -37,7 +48,7 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        exclude = ('modified_at', 'thread', 'id',)
+        exclude = ('modified_at', 'thread', 'board', 'id', 'search_vector',)
         depth = 1
 
 
@@ -48,7 +59,7 @@ class BoardSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Board
-        exclude = ('modified_at', 'created_at',)
+        exclude = ('modified_at', 'created_at', 'last_post_id',)
         depth = 1
 
 
@@ -64,10 +75,10 @@ class ThreadSerializer(serializers.ModelSerializer):
         """
         Предзагрузка для решения проблемы N+1.
         """
-        queryset = queryset.prefetch_related('posts', 'posts__files')
+        queryset = queryset.prefetch_related('posts', 'posts__files', 'posts__files__renditions')
         return queryset
 
     class Meta:
         model = Thread
-        exclude = ('id',)
+        exclude = ('id', 'op_post',)
         depth = 2
@@ -0,0 +1,140 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Материализованные снимки JSON тредов.
+
+``get_thread`` отдает снимок как есть, без обращения к постам и файлам.
+Посты снимка хранятся частями по ``CHUNK_POSTS``: новый пост дописывается
+при постинге (``append_post``) в последнюю часть, так что постинг перезаписывает
+не больше одной части, какой бы длинный ни был тред. Любое другое
+изменение треда (правка в админке, готовый эскиз, ``touch_threads``) меняет
+``Thread.modified_at``, и снимок пересобирается при следующем чтении.
+
+Ссылки на файлы в снимке подписаны и истекают (``AWS_QUERYSTRING_EXPIRE``),
+поэтому снимок старше ``SNAPSHOT_MAX_AGE`` тоже пересобирается, даже если тред не менялся.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.encoders import encode
+from api.fast_serializers import serialize_thread
+from api.models import Thread, ThreadSnapshot, ThreadSnapshotChunk
+from gchan import settings
+
+# Постов в одной части снимка
+CHUNK_POSTS = 50
+
+
+def render(header: bytes, chunks: Iterable[bytes]) -> bytes:
+    """
+    Собирает JSON треда: ``posts`` — первый ключ в выводе ``ThreadSerializer``.
+    """
+    return b'{"posts":[' + b','.join(bytes(chunk) for chunk in chunks) + b'],' + bytes(header)[1:]
+
+
+def split_posts(posts: List[bytes]) -> List[List[bytes]]:
+    """
+    Делит JSON постов на части по ``CHUNK_POSTS``.
+    """
+    return [posts[i:i + CHUNK_POSTS] for i in range(0, len(posts), CHUNK_POSTS)]
+
+
+def built_after() -> datetime:
+    """
+    Самое раннее время сборки актуального снимка: ссылки в более старых снимках скоро истекут.
+    """
+    return timezone.now() - timedelta(seconds=settings.SNAPSHOT_MAX_AGE)
+
+
+def get_thread_json(board_name: str, thread_pk: int) -> Optional[bytes]:
+    """
+    JSON треда из актуального снимка; если снимка нет, он устарел или его ссылки
+    на файлы скоро истекут, тред сериализуется заново и снимок сохраняется.
+
+    :param board_name: Короткое имя доски.
+    :param thread_pk: ``pk`` треда.
+    :return: JSON или ``None``, если на доске нет такого треда.
+    """
+    # Одним запросом, чтобы заголовок и посты были из одной версии снимка
+    rows = list(ThreadSnapshotChunk.objects.filter(
+        snapshot__thread=thread_pk, snapshot__thread__board__board_name=board_name,
+        snapshot__modified_at=F('snapshot__thread__modified_at'), snapshot__built_at__gt=built_after(),
+    ).order_by('number').values_list('snapshot__header', 'posts'))
+    if rows:
+        return render(rows[0][0], [posts for _, posts in rows])
+
+    # Версия читается до сериализации: если тред изменится во время нее,
+    # снимок сразу окажется устаревшим, а не останется с неполными данными.
+    threads = Thread.objects.filter(pk=thread_pk, board__board_name=board_name)
+    modified_at = threads.values_list('modified_at', flat=True).first()
+    if modified_at is None:
+        return None
+    built_at = timezone.now()  # Ссылки подписываются во время сериализации
+    data = serialize_thread(threads)
+    chunks = split_posts([encode(post) for post in data.pop('posts')])
+    header = encode(data)
+    try:
+        with transaction.atomic():
+            snapshot, _ = ThreadSnapshot.objects.update_or_create(thread_id=thread_pk, defaults={
+                'header': header,
+                'modified_at': modified_at,
+                'built_at': built_at,
+            })
+            snapshot.chunks.all().delete()
+            ThreadSnapshotChunk.objects.bulk_create([
+                ThreadSnapshotChunk(snapshot=snapshot, number=number, posts=b','.join(posts), post_count=len(posts))
+                for number, posts in enumerate(chunks)
+            ])
+    except IntegrityError:  # Снимок одновременно создал другой запрос
+        pass
+    return render(header, [b','.join(posts) for posts in chunks])
+
+
+def lock_snapshot(thread: Thread) -> Optional[ThreadSnapshot]:
+    """
+    Блокирует актуальный снимок треда вместе с самим тредом.
+    Вызывать внутри ``transaction.atomic()`` до изменения треда.
+
+    :return: Снимок или ``None``, если его нет или он устарел.
+    """
+    return ThreadSnapshot.objects.select_for_update() \
+        .filter(thread=thread, modified_at=F('thread__modified_at'), built_at__gt=built_after()).first()
+
+
+def append_post(snapshot: ThreadSnapshot, thread: Thread, post_data: Dict):
+    """
+    Дописывает новый пост в последнюю часть снимка, полученного из ``lock_snapshot``
+    (или начинает новую часть), и обновляет заголовок треда (счетчики, время бампа, доску).
+
+    :param snapshot: Снимок.
+    :param thread: Тред после сохранения поста.
+    :param post_data: Сериализованный пост.
+    """
+    header = serialize_thread(Thread.objects.filter(pk=thread.pk), with_posts=False)
+    del header['posts']
+    post = encode(post_data)
+    chunk = snapshot.chunks.order_by('-number').first()
+    if chunk is None or chunk.post_count >= CHUNK_POSTS:
+        ThreadSnapshotChunk.objects.create(snapshot=snapshot, number=chunk.number + 1 if chunk else 0,
+                                           posts=post, post_count=1)
+    else:
+        chunk.posts = bytes(chunk.posts) + b',' + post
+        chunk.post_count += 1
+        chunk.save(update_fields=['posts', 'post_count'])
+    snapshot.header = encode(header)
+    snapshot.modified_at = thread.modified_at
+    snapshot.save()
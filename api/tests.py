@@ -0,0 +1,921 @@
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Тесты API. Нужен PostgreSQL (как и приложению); файлы пишутся во временный каталог.
+"""
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import warnings
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.admin.sites import site
+from django.core.cache import CacheKeyWarning
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.fields import DateTimeField
+from rest_framework.renderers import JSONRenderer
+
+from api import cache, events, middleware, snapshots, views
+from api.encoders import JsonResponse, encode_orjson, encode_stdlib, orjson
+from api.fast_serializers import serialize_board, serialize_posts, serialize_thread
+from api.media import MAX_THUMB_SIZE, decode_for_previews, fit_size, open_image, process_next_thumbnail_job
+from api.middleware import CompressionMiddleware, brotli, choose_encoding
+from api.models import Board, File, Post, Thread, ThreadSnapshot, ThreadSnapshotChunk, UploadSession, \
+    THREADS_PER_PAGE
+from api.queries import CATALOG_SNIPPET_LENGTH
+from api.serializers import BoardSerializer, PostSerializer, ThreadSerializer
+from gchan import settings
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='gchan-tests-')
+
+
+def make_png(seed: int = 0) -> bytes:
+    """
+    Небольшая картинка, у каждого ``seed`` своя.
+    """
+    image = Image.new('RGB', (64, 48), (seed % 256, 80, 160))
+    for x in range(0, 64, 8):
+        image.paste((255 - seed % 256, x * 4, 0), (x, 0, x + 4, 48))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=MEDIA_ROOT)
+class ApiTestCase(TestCase):
+    """
+    Доска ``b`` и помощники для загрузки файлов и постинга.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.board = Board.objects.create(board_name='b', description='бред', pages=2, bump_limit=500,
+                                          default_name='Аноним', max_file_size=1024, max_text_size=8000,
+                                          closed=False)
+
+    def upload(self, seed: int = 0, content: bytes = None) -> str:
+        """
+        Загружает картинку (эскиз строится в фоне) и возвращает ее хэш.
+
+        :param seed: Какую картинку из ``make_png`` загрузить.
+        :param content: PNG вместо картинки из ``make_png``.
+        """
+        content = make_png(seed) if content is None else content
+        with mock.patch.object(settings, 'THUMBNAILS_IN_BACKGROUND', True):
+            response = self.client.post(reverse('upload-file', args=['b']),
+                                        {'pic.png': SimpleUploadedFile('pic.png', content, 'image/png')})
+        result = response.json()['response'][0]['pic.png']
+        self.assertTrue(result['success'], result)
+        return result['hash']
+
+    def post(self, data: dict, thread_id: int = None):
+        """
+        Создает тред или пост в треде ``thread_id``.
+        """
+        if thread_id is None:
+            url = reverse('create-thread', args=['b'])
+        else:
+            url = reverse('create-post', args=['b', thread_id])
+        return self.client.post(url, json.dumps(data), content_type='application/json').json()
+
+    def create_thread(self, text: str = 'ОП', **data) -> int:
+        """
+        Создает тред с одной картинкой и возвращает его номер (``pk`` ОП-поста).
+        """
+        data.setdefault('files', [self.upload()])
+        result = self.post(dict(data, text=text))
+        self.assertTrue(result['success'], result)
+        return Post.objects.get(board=self.board, post_id=result['data']['post_id']).pk
+
+
+class ThumbnailInvalidationTest(ApiTestCase):
+    """
+    Готовый эскиз должен попадать в уже закэшированные и отданные ответы.
+    """
+
+    def test_thread_shows_preview_after_worker(self):
+        thread_id = self.create_thread()
+        url = reverse('get-thread', args=['b', thread_id])
+        file = self.client.get(url).json()['posts'][0]['files'][0]
+        self.assertEqual(file['status'], File.StatusEnum.PENDING.value)
+        self.assertIsNone(file['preview_content'])
+
+        self.assertTrue(process_next_thumbnail_job())
+
+        file = self.client.get(url).json()['posts'][0]['files'][0]
+        self.assertEqual(file['status'], File.StatusEnum.READY.value)
+        self.assertIsNotNone(file['preview_content'])
+
+
+@mock.patch.object(settings, 'RESPONSE_CACHE_ENABLED', True)
+# В TestCase транзакция не коммитится, и версии сбрасывались бы только в on_commit
+@mock.patch.object(cache, 'transaction', mock.Mock(on_commit=lambda func: func()))
+class ResponseCacheTest(ApiTestCase):
+    """
+    Кэш ответов (на LocMem, который в тестах выключен по умолчанию).
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.get_cache().clear()
+
+    def get(self, url: str):
+        """
+        Запрашивает URL и возвращает ответ и было ли это попаданием в кэш.
+        """
+        hits = cache.get_stats()['hits']
+        response = self.client.get(url)
+        return response, cache.get_stats()['hits'] > hits
+
+    def assert_invalidated(self, url: str, action):
+        """
+        Проверяет, что ``url`` закэширован, а после ``action`` строится заново.
+        """
+        content = self.get(url)[0].content
+        response, hit = self.get(url)
+        self.assertTrue(hit, url)
+        self.assertEqual(response.content, content)
+        action()
+        response, hit = self.get(url)
+        self.assertFalse(hit, url)
+        return response
+
+    def test_hit_after_miss(self):
+        url = reverse('get-thread', args=['b', self.create_thread()])
+        response, hit = self.get(url)
+        self.assertFalse(hit)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 1})
+        cached, hit = self.get(url)
+        self.assertTrue(hit)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_posting_invalidates(self):
+        thread_id = self.create_thread()
+        for url in (reverse('get-thread', args=['b', thread_id]), reverse('get-all-threads', args=['b', 0])):
+            response = self.assert_invalidated(url, lambda: self.post({'text': url, 'files': []}, thread_id))
+            self.assertContains(response, url)
+
+    def test_pruning_invalidates(self):
+        thread_id = self.create_thread()
+        thread_pk = Thread.objects.get(posts=thread_id).pk
+
+        def prune():
+            Board.objects.filter(pk='b').update(pages=0)
+            self.assertEqual(Board.objects.get(pk='b').prune_threads(), [thread_pk])
+
+        self.get(reverse('get-all-threads', args=['b', 0]))
+        response = self.assert_invalidated(reverse('get-thread', args=['b', thread_id]), prune)
+        self.assertEqual(response.status_code, 404)
+        response, hit = self.get(reverse('get-all-threads', args=['b', 0]))
+        self.assertFalse(hit)
+        self.assertEqual(response.json()['threads'], [])
+
+    def test_admin_edits_invalidate(self):
+        thread_id = self.create_thread()
+        self.post({'text': 'ответ', 'files': []}, thread_id)
+        url = reverse('get-thread', args=['b', thread_id])
+        post_admin = site._registry[Post]
+        reply = Post.objects.get(text='ответ')
+
+        def edit():
+            reply.text = 'исправлено'
+            post_admin.save_model(None, reply, None, True)
+
+        self.assertContains(self.assert_invalidated(url, edit), 'исправлено')
+        response = self.assert_invalidated(url, lambda: post_admin.delete_model(None, reply))
+        self.assertNotContains(response, 'исправлено')
+
+    def test_thumbnail_job_invalidates(self):
+        thread_id = self.create_thread()
+        response = self.assert_invalidated(reverse('get-thread', args=['b', thread_id]),
+                                           lambda: self.assertTrue(process_next_thumbnail_job()))
+        self.assertIsNotNone(response.json()['posts'][0]['files'][0]['preview_content'])
+
+    def test_board_rename_clears_cache(self):
+        self.create_thread()
+        url = reverse('get-all-threads', args=['b', 0])
+        self.get(url)
+        self.assertTrue(self.get(url)[1])
+        self.board.board_name = 'c'
+        site._registry[Board].save_model(None, self.board, mock.Mock(changed_data=['board_name']), True)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 0})
+        self.assertFalse(self.get(url)[1])
+
+    def test_keys_from_url_are_safe(self):
+        # LocMem только предупреждает о ключах, которые memcached не принял бы
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            for board_name in ('b c', 'б' * 300):
+                for url in (reverse('get-all-threads', args=[board_name, 0]),
+                            reverse('get-thread', args=[board_name, 1]),
+                            reverse('get-post', args=[board_name, 1])):
+                    self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    def test_compressed_variant_expires_with_response(self):
+        url = reverse('get-thread', args=['b', self.create_thread()])
+        now = time.time()
+        with mock.patch.object(cache.time, 'time', return_value=now):
+            self.assertEqual(self.client.get(url).compression_cache_timeout, settings.RESPONSE_CACHE_TIMEOUT)
+        with mock.patch.object(cache.time, 'time', return_value=now + settings.RESPONSE_CACHE_TIMEOUT - 10):
+            self.assertEqual(self.client.get(url).compression_cache_timeout, 10)
+        self.assertLess(settings.RESPONSE_CACHE_TIMEOUT + settings.SNAPSHOT_MAX_AGE, settings.AWS_QUERYSTRING_EXPIRE)
+
+
+class ConditionalGetTest(ApiTestCase):
+    """
+    ETag треда и доски меняется с любым изменением, которое видно в ответе.
+    """
+
+    def test_not_modified(self):
+        url = reverse('get-thread', args=['b', self.create_thread()])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_thumbnail_changes_etag(self):
+        thread_id = self.create_thread()
+        urls = [reverse('get-thread', args=['b', thread_id]), reverse('get-all-threads', args=['b', 0])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        self.assertTrue(process_next_thumbnail_job())
+
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag, url)
+
+
+class SnapshotTest(ApiTestCase):
+    """
+    Снимок треда совпадает со свежей сериализацией и после дописывания постов.
+    """
+
+    @mock.patch.object(snapshots, 'CHUNK_POSTS', 2)
+    def test_append_across_chunks(self):
+        thread_id = self.create_thread()
+        url = reverse('get-thread', args=['b', thread_id])
+        self.client.get(url)  # Создает снимок
+        for i in range(4):
+            self.assertTrue(self.post({'text': f'ответ {i}', 'files': []}, thread_id)['success'])
+
+        thread = Thread.objects.get(posts=thread_id)
+        self.assertEqual(ThreadSnapshotChunk.objects.filter(snapshot=thread.pk).count(), 3)
+        self.assertEqual(self.client.get(url).json(), json.loads(json.dumps(
+            serialize_thread(Thread.objects.filter(pk=thread.pk)), cls=DjangoJSONEncoder)))
+
+    def test_old_snapshot_is_rebuilt(self):
+        thread_id = self.create_thread()
+        url = reverse('get-thread', args=['b', thread_id])
+        content = self.client.get(url).content
+        # Подменяем части снимка, чтобы отличить отданный снимок от пересобранного
+        ThreadSnapshotChunk.objects.update(posts=b'{}')
+        self.assertEqual(json.loads(self.client.get(url).content)['posts'], [{}])
+
+        old = timezone.now() - timedelta(seconds=settings.SNAPSHOT_MAX_AGE + 1)
+        ThreadSnapshot.objects.update(built_at=old)
+        thread = Thread.objects.get(posts=thread_id)
+        self.assertIsNone(snapshots.lock_snapshot(thread))  # Новый пост не дописывается в старый снимок
+        self.assertEqual(self.client.get(url).content, content)
+        self.assertGreater(ThreadSnapshot.objects.get(thread=thread).built_at, old)
+
+
+class ThreadPagingTest(ApiTestCase):
+    """
+    Листание тредов по номеру страницы и курсору.
+    """
+
+    def create_threads(self, count: int):
+        file_hash = self.upload()
+        for i in range(count):
+            self.create_thread(f'тред {i}', files=[file_hash])
+
+    def test_no_cursor_on_last_full_page(self):
+        self.create_threads(THREADS_PER_PAGE)
+        data = self.client.get(reverse('get-all-threads', args=['b', 0])).json()
+        self.assertEqual(len(data['threads']), THREADS_PER_PAGE)
+        self.assertIsNone(data['next_cursor'])
+        data = self.client.get(reverse('get-threads-page', args=['b'])).json()
+        self.assertIsNone(data['next_cursor'])
+
+    def test_cursor_pages_survive_bumps(self):
+        self.create_threads(THREADS_PER_PAGE + 5)
+        data = self.client.get(reverse('get-all-threads', args=['b', 0])).json()
+        first_page = [thread['posts'][0]['text'] for thread in data['threads']]
+        self.assertIsNotNone(data['next_cursor'])
+
+        # Бамп треда со второй страницы не должен сдвигать вторую страницу
+        bumped = Post.objects.get(board=self.board, text='тред 0').pk
+        self.assertTrue(self.post({'text': 'бамп', 'files': []}, bumped)['success'])
+
+        data = self.client.get(reverse('get-threads-page', args=['b']), {'cursor': data['next_cursor']}).json()
+        second_page = [thread['posts'][0]['text'] for thread in data['threads']]
+        self.assertIsNone(data['next_cursor'])
+        # Поднятый тред теперь на первой странице, остальные не сдвинулись и не повторились
+        self.assertEqual(second_page, [f'тред {i}' for i in range(4, 0, -1)])
+        self.assertFalse(set(first_page) & set(second_page))
+
+    def test_invalid_cursor(self):
+        wrong_values = [[1, 2, 3], [False, '2019-01-01T00:00:00+00:00', 2 ** 40]]
+        for cursor in ['мусор', 'x' * 1000] + [base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+                                               for value in wrong_values]:
+            response = self.client.get(reverse('get-threads-page', args=['b']), {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertFalse(response.json()['success'])
+
+
+class AdminSearchTest(ApiTestCase):
+    """
+    Поиск постов и тредов в админке.
+    """
+
+    def test_search(self):
+        thread_id = self.create_thread('Кошки спят на диване', trip_code='!TrIp', email='op@example.com')
+        self.post({'text': 'собаки лают', 'files': []}, thread_id)
+        post_admin, thread_admin = site._registry[Post], site._registry[Thread]
+        op_post_id = Post.objects.get(pk=thread_id).post_id
+        for term in ('кошка', '!TrIp', 'op@example.com', str(op_post_id)):
+            posts, _ = post_admin.get_search_results(None, Post.objects.all(), term)
+            self.assertEqual([post.pk for post in posts], [thread_id], term)
+            threads, _ = thread_admin.get_search_results(None, Thread.objects.all(), term)
+            self.assertEqual(list(threads.distinct().values_list('op_post', flat=True)), [thread_id], term)
+
+
+class PostingTest(ApiTestCase):
+    """
+    Неудачный пост не оставляет следов: ни поста, ни номера, ни изменений треда.
+    """
+
+    @staticmethod
+    def get_state(thread_id: int):
+        """
+        Все, что меняет пост: количество постов и тредов, счетчик номеров доски, счетчики треда.
+        """
+        return (Post.objects.count(), Thread.objects.count(),
+                Board.objects.values_list('last_post_id').get(pk='b'),
+                Thread.objects.values_list('post_count', 'last_post_id', 'modified_at').get(posts=thread_id))
+
+    def assert_nothing_changed(self, thread_id: int, action):
+        url = reverse('get-thread', args=['b', thread_id])
+        thread_json = self.client.get(url).content  # Создает снимок
+        before = self.get_state(thread_id)
+        result = action()
+        self.assertFalse(result['success'], result)
+        self.assertEqual(self.get_state(thread_id), before)
+        self.assertEqual(self.client.get(url).content, thread_json)
+
+    def test_validation_error_rolls_back(self):
+        thread_id = self.create_thread()
+        self.assert_nothing_changed(thread_id, lambda: self.post({'text': '', 'files': []}, thread_id))
+
+    def test_database_error_rolls_back(self):
+        thread_id = self.create_thread()
+        self.assert_nothing_changed(thread_id, lambda: self.post({'text': 'x', 'name': 'x' * 65, 'files': []},
+                                                                 thread_id))
+
+    def test_invalid_thread_rolls_back(self):
+        thread_id = self.create_thread()
+        self.assert_nothing_changed(thread_id, lambda: self.post({'text': '', 'files': [self.upload(1)]}))
+
+    def test_post_ids_are_sequential(self):
+        thread_id = self.create_thread()
+        for i in range(3):
+            self.post({'text': f'ответ {i}', 'files': []}, thread_id)
+        self.assertEqual(list(Post.objects.filter(board=self.board).values_list('post_id', flat=True)), [1, 2, 3, 4])
+
+    def test_validate_unique_per_board(self):
+        thread_id = self.create_thread()
+        post = Post.objects.get(pk=thread_id)
+        duplicate = Post(thread=post.thread, post_id=post.post_id, text='x')
+        with self.assertRaises(ValidationError):
+            duplicate.validate_unique(exclude=['board'])
+        duplicate.post_id += 1
+        duplicate.validate_unique(exclude=['board'])
+
+
+class DecodeForPreviewsTest(SimpleTestCase):
+    """
+    Быстрые пути декодирования для эскизов дают картинку не меньше самого большого эскиза.
+    """
+
+    @staticmethod
+    def open(image: Image.Image, fmt: str, **params) -> Image.Image:
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, **params)
+        buffer.seek(0)
+        return open_image(buffer)
+
+    def test_large_jpeg_is_decoded_reduced(self):
+        image = self.open(Image.new('RGB', (4000, 3000), (200, 10, 10)), 'JPEG')
+        decoded = decode_for_previews(image, File.FileTypeEnum.JPEG.value, 500)
+        self.assertEqual(decoded.mode, 'RGB')
+        self.assertTrue(500 <= decoded.width <= 1000, decoded.size)
+        self.assertAlmostEqual(decoded.width / decoded.height, 4 / 3, places=1)
+
+    def test_cmyk_jpeg_is_converted(self):
+        image = self.open(Image.new('CMYK', (300, 200)), 'JPEG')
+        self.assertEqual(decode_for_previews(image, File.FileTypeEnum.JPEG.value, 250).mode, 'RGB')
+
+    def test_transparent_png_keeps_alpha(self):
+        image = Image.new('P', (300, 200))
+        image = self.open(image, 'PNG', transparency=0)
+        self.assertEqual(decode_for_previews(image, File.FileTypeEnum.PNG.value, 250).mode, 'RGBA')
+
+    def test_animated_gif_uses_first_frame(self):
+        frames = [Image.new('RGB', (100, 100), color) for color in ((255, 0, 0), (0, 255, 0), (0, 0, 255))]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:])
+        buffer.seek(0)
+        image = open_image(buffer)
+        image.seek(2)
+        decoded = decode_for_previews(image, File.FileTypeEnum.GIF.value, 250)
+        self.assertEqual(decoded.convert('RGB').getpixel((0, 0)), (255, 0, 0))
+
+    def test_too_many_pixels_rejected(self):
+        with mock.patch.object(settings, 'THUMBNAIL_MAX_PIXELS', 100 * 100):
+            with self.assertRaises(ValueError):
+                self.open(Image.new('RGB', (200, 100)), 'PNG')
+
+
+class ThumbnailTest(ApiTestCase):
+    """
+    Эскизы большой картинки.
+    """
+
+    def test_large_jpeg_thumbnail(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (3000, 1500), (10, 120, 30)).save(buffer, 'JPEG')
+        with mock.patch.object(settings, 'THUMBNAILS_IN_BACKGROUND', True):
+            response = self.client.post(reverse('upload-file', args=['b']),
+                                        {'big.jpg': SimpleUploadedFile('big.jpg', buffer.getvalue(), 'image/jpeg')})
+        file_hash = response.json()['response'][0]['big.jpg']['hash']
+        self.assertTrue(process_next_thumbnail_job())
+
+        file = File.objects.get(pk=file_hash)
+        self.assertEqual((file.width, file.height), (3000, 1500))
+        self.assertEqual((file.thumbnailWidth, file.thumbnailHeight), (MAX_THUMB_SIZE, MAX_THUMB_SIZE // 2))
+        with file.preview_content.open('rb') as preview:
+            self.assertEqual(Image.open(preview).size, (MAX_THUMB_SIZE, MAX_THUMB_SIZE // 2))
+        # Варианты эскиза не повторяют сам эскиз
+        self.assertEqual(sorted(file.renditions.values_list('name', 'width')),
+                         sorted((rendition['name'], fit_size(3000, 1500, rendition['size'])[0])
+                                for rendition in settings.PREVIEW_RENDITIONS))
+        self.assertNotIn(MAX_THUMB_SIZE, file.renditions.values_list('width', flat=True))
+
+
+@mock.patch.object(settings, 'PHASH_REUSE_CONTENT', True)
+class ReuseContentTest(ApiTestCase):
+    """
+    Та же картинка в других байтах ссылается на уже сохраненный контент, а картинка
+    с тем же перцептивным хэшем, но другими пикселями — нет.
+    """
+
+    def upload_image(self, image: Image.Image, **params) -> File:
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG', **params)
+        file_hash = self.upload(content=buffer.getvalue())
+        self.assertTrue(process_next_thumbnail_job())
+        return File.objects.get(pk=file_hash)
+
+    def test_reuse_only_same_pixels(self):
+        image = Image.open(io.BytesIO(make_png()))
+        original = self.upload_image(image)
+
+        same = self.upload_image(image, compress_level=1)
+        self.assertNotEqual(same.pk, original.pk)
+        self.assertEqual(same.content.name, original.content.name)
+        self.assertEqual(same.size, original.size)
+
+        changed = image.copy()
+        changed.putpixel((0, 0), (1, 2, 3))
+        changed = self.upload_image(changed)
+        self.assertEqual(changed.phash, original.phash)
+        self.assertNotEqual(changed.content.name, original.content.name)
+        with changed.content.open('rb') as content:
+            self.assertEqual(Image.open(content).getpixel((0, 0)), (1, 2, 3))
+
+
+class ResumableUploadTest(ApiTestCase):
+    """
+    Загрузка файла по частям.
+    """
+
+    def setUp(self):
+        super().setUp()
+        spool_dir = tempfile.mkdtemp(prefix='gchan-spool-')
+        self.addCleanup(shutil.rmtree, spool_dir, ignore_errors=True)
+        patcher = mock.patch.object(settings, 'UPLOAD_SPOOL_DIR', spool_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        buffer = io.BytesIO()
+        Image.effect_noise((100, 100), 64).save(buffer, 'PNG')  # Шум почти не сжимается: файл в несколько частей
+        self.content = buffer.getvalue()
+
+    def start(self) -> UploadSession:
+        data = self.client.post(reverse('create-upload-session', args=['b']),
+                                json.dumps({'filename': 'pic.png', 'size': len(self.content)}),
+                                content_type='application/json').json()
+        self.assertTrue(data['success'], data)
+        self.assertEqual(data['offset'], 0)
+        return UploadSession.objects.get(pk=data['id'])
+
+    def put(self, session: UploadSession, offset: int, chunk: bytes, **extra):
+        return self.client.put(reverse('upload-chunk', args=[session.pk]), chunk,
+                               content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset), **extra)
+
+    def finish(self, session: UploadSession):
+        with mock.patch.object(settings, 'THUMBNAILS_IN_BACKGROUND', True):
+            return self.client.post(reverse('finish-upload', args=[session.pk]))
+
+    def test_chunks_give_same_file_as_single_upload(self):
+        self.assertGreater(len(self.content), 3000)
+        session = self.start()
+        for offset in range(0, len(self.content), 1000):
+            response = self.put(session, offset, self.content[offset:offset + 1000])
+            self.assertEqual(response.json()['offset'], min(offset + 1000, len(self.content)))
+        result = self.finish(session).json()['response'][0]['pic.png']
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['hash'], hashlib.sha512(self.content).hexdigest())
+        self.assertEqual(result['hash'], self.upload(content=self.content))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.spool_path))
+
+    def test_offset_mismatch(self):
+        session = self.start()
+        self.put(session, 0, self.content[:1000])
+        response = self.put(session, 0, self.content[:1000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 1000)
+
+    def test_offset_changed_while_reading(self):
+        session = self.start()
+        get_upload_session = views.get_upload_session
+
+        def concurrent_chunk(queryset, session_id):
+            # Пока тело читалось, другой запрос успел дописать свою часть
+            if not queryset.query.select_for_update:
+                UploadSession.objects.filter(pk=session_id).update(offset=1000)
+            return get_upload_session(queryset, session_id)
+
+        with mock.patch.object(views, 'get_upload_session', side_effect=concurrent_chunk):
+            response = self.put(session, 0, self.content[:1000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 1000)
+        self.assertEqual(os.path.getsize(session.spool_path), 0)
+
+    def test_short_body(self):
+        session = self.start()
+        with open(session.spool_path, 'wb') as spool:
+            spool.write(b'x' * 2000)  # Хвост записи, оборванной до сохранения смещения
+        response = self.put(session, 0, b'', CONTENT_LENGTH='1000', **{'wsgi.input': io.BytesIO(self.content[:600])})
+        self.assertEqual(response.json()['offset'], 600)
+        with open(session.spool_path, 'rb') as spool:
+            self.assertEqual(spool.read(), self.content[:600])
+
+    def test_finish_incomplete(self):
+        session = self.start()
+        self.put(session, 0, self.content[:1000])
+        data = self.finish(session).json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['offset'], 1000)
+        self.assertTrue(UploadSession.objects.filter(pk=session.pk).exists())
+
+    def test_expired_session(self):
+        session = self.start()
+        UploadSession.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.client.get(reverse('upload-chunk', args=[session.pk])).status_code, 404)
+        self.assertEqual(self.put(session, 0, self.content[:1000]).status_code, 404)
+        self.assertEqual(self.finish(session).status_code, 404)
+
+    def test_spool_missing(self):
+        session = self.start()
+        self.put(session, 0, self.content[:1000])
+        os.remove(session.spool_path)
+        with self.assertLogs('api.views', 'ERROR'):
+            self.assertEqual(self.put(session, 1000, self.content[1000:]).status_code, 410)
+        UploadSession.objects.update(offset=session.size)
+        with self.assertLogs('api.views', 'ERROR'):
+            self.assertEqual(self.finish(session).status_code, 410)
+
+
+class CatalogTest(ApiTestCase):
+    """
+    Каталог доски.
+    """
+
+    def get_catalog(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('get-board-catalog', args=['b'])).json()
+        return data, len(queries)
+
+    def test_catalog(self):
+        thread_id = self.create_thread('т' * (CATALOG_SNIPPET_LENGTH + 10), subject='Тема')
+        self.post({'text': 'ответ', 'files': [self.upload(1)]}, thread_id)
+        data, _ = self.get_catalog()
+        self.assertEqual(data['board'], 'b')
+        thread, = data['threads']
+        self.assertEqual(thread['thread'], thread_id)
+        self.assertEqual(thread['subject'], 'Тема')
+        self.assertEqual(thread['snippet'], 'т' * CATALOG_SNIPPET_LENGTH)
+        self.assertEqual((thread['post_count'], thread['file_post_count']), (2, 2))
+        self.assertIsNone(thread['thumbnail'])  # Эскиз еще не готов
+
+        while process_next_thumbnail_job():
+            pass
+        thread, = self.get_catalog()[0]['threads']
+        self.assertEqual((thread['thumbnail']['width'], thread['thumbnail']['height']), (MAX_THUMB_SIZE, 187))
+
+    def test_query_count_does_not_depend_on_threads(self):
+        self.create_thread()
+        _, few = self.get_catalog()
+        file_hash = self.upload()
+        for i in range(5):
+            self.create_thread(f'тред {i}', files=[file_hash])
+        data, many = self.get_catalog()
+        self.assertEqual(len(data['threads']), 6)
+        self.assertEqual(few, many)
+
+
+class FastSerializersTest(ApiTestCase):
+    """
+    Быстрые сериализаторы дают тот же JSON, что и DRF, байт в байт.
+    """
+
+    def test_same_as_drf(self):
+        thread_id = self.create_thread('ОП', subject='Тема')
+        self.post({'text': 'без файлов', 'email': 'sage', 'files': []}, thread_id)
+        self.post({'text': 'два файла', 'files': [self.upload(1), self.upload(2)]}, thread_id)
+        process_next_thumbnail_job()  # Один файл готов (с вариантами эскиза), остальные ждут
+        thread = Thread.objects.get(posts=thread_id)
+        renderer = JSONRenderer()
+
+        expected = ThreadSerializer(ThreadSerializer.setup_eager_loading(Thread.objects).get(pk=thread.pk)).data
+        actual = serialize_thread(Thread.objects.filter(pk=thread.pk))
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+        posts = Post.objects.filter(thread=thread)
+        self.assertEqual(renderer.render(serialize_posts(posts)),
+                         renderer.render(PostSerializer(posts.prefetch_related('files__renditions'), many=True).data))
+        self.assertEqual(renderer.render(serialize_board('b')), renderer.render(BoardSerializer(self.board).data))
+        self.assertIsNone(serialize_board('нет'))
+        self.assertEqual(serialize_posts(Post.objects.none()), [])
+
+
+class EncodersTest(SimpleTestCase):
+    """
+    Оба кодировщика дают одинаковый компактный JSON с датами в формате DRF.
+    """
+    data = {
+        'text': 'Кошки > собаки "в кавычках"\n ',
+        'created_at': timezone.make_aware(datetime(2019, 3, 1, 12, 30, 15, 123456)),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'size': Decimal('1.50'),
+        'nested': [{'a': None, 'b': True, 'c': 1.5}, []],
+    }
+
+    def test_stdlib(self):
+        encoded = encode_stdlib(self.data)
+        self.assertNotIn(b': ', encoded)
+        decoded = json.loads(encoded)
+        self.assertEqual(decoded['text'], self.data['text'])
+        self.assertEqual(decoded['created_at'], DateTimeField().to_representation(self.data['created_at']))
+        self.assertEqual(decoded['id'], str(self.data['id']))
+
+    @skipUnless(orjson, 'orjson не установлен')
+    def test_orjson_same_as_stdlib(self):
+        self.assertEqual(json.loads(encode_orjson(self.data)), json.loads(encode_stdlib(self.data)))
+        posts = [{'post_id': i, 'text': 'т' * i, 'created_at': self.data['created_at']} for i in range(50)]
+        self.assertEqual(encode_orjson(posts), encode_stdlib(posts))
+
+    def test_json_response(self):
+        response = JsonResponse({'a': 1})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, b'{"a":1}')
+        with self.assertRaises(TypeError):
+            JsonResponse([1])
+        self.assertEqual(JsonResponse([1], safe=False).content, b'[1]')
+
+
+class InMemoryBrokerTest(SimpleTestCase):
+    """
+    Очереди подписчиков и возобновление по ``Last-Event-ID``.
+    """
+
+    def setUp(self):
+        self.broker = events.InMemoryBroker()
+
+    def publish(self, count: int) -> list:
+        published = []
+        for i in range(count):
+            self.broker.publish(['thread:1'], 'post', {'i': i})
+            published.append(self.broker.history['thread:1'][-1])
+        return published
+
+    def receive(self, subscription) -> list:
+        """
+        Все события, которые уже есть в подписке.
+        """
+        received = []
+        event = subscription.get(timeout=0)
+        while event is not None:
+            received.append(event)
+            if event.type == events.RESET_EVENT:
+                break
+            event = subscription.get(timeout=0)
+        return received
+
+    @mock.patch.object(settings, 'EVENTS_QUEUE_SIZE', 2)
+    def test_overflow_becomes_reset(self):
+        subscription = self.broker.subscribe('thread:1')
+        published = self.publish(3)
+        received = self.receive(subscription)
+        self.assertEqual(received[:2], published[:2])
+        self.assertEqual([event.type for event in received[2:]], [events.RESET_EVENT])
+
+    def test_resume_inside_history(self):
+        published = self.publish(3)
+        self.assertEqual(self.receive(self.broker.subscribe('thread:1', published[0].id)), published[1:])
+        self.assertEqual(self.receive(self.broker.subscribe('thread:1', published[-1].id)), [])
+        self.assertEqual(self.receive(self.broker.subscribe('thread:2', published[-1].id)), [])
+
+    @mock.patch.object(settings, 'EVENTS_HISTORY', 2)
+    def test_resume_beyond_history(self):
+        published = self.publish(4)
+        received = self.receive(self.broker.subscribe('thread:1', published[0].id))
+        self.assertEqual([event.type for event in received], [events.RESET_EVENT])
+        self.assertEqual(self.receive(self.broker.subscribe('thread:1', published[1].id)), published[2:])
+
+    def test_resume_after_restart(self):
+        # Событие из прошлого процесса: что было после него, неизвестно
+        received = self.receive(self.broker.subscribe('thread:1', self.broker.first_id - 1))
+        self.assertEqual([event.type for event in received], [events.RESET_EVENT])
+
+    def test_unsubscribe(self):
+        first, second = self.broker.subscribe('thread:1'), self.broker.subscribe('thread:1')
+        first.close()
+        self.publish(1)
+        self.assertEqual(self.broker.subscribers['thread:1'], {second})
+        self.assertEqual(self.receive(first), [])
+        second.close()
+        self.assertNotIn('thread:1', self.broker.subscribers)
+
+
+@mock.patch.object(settings, 'EVENTS_SINGLE_PROCESS', True)
+class PublishTest(TransactionTestCase):
+    """
+    События публикуются только после коммита.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(events, '_broker', events.InMemoryBroker())
+        self.broker = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.subscription = self.broker.subscribe('thread:1')
+        self.addCleanup(self.subscription.close)
+
+    def test_published_on_commit(self):
+        with transaction.atomic():
+            events.publish(['thread:1'], 'post', {'text': 'пост'})
+            self.assertIsNone(self.subscription.get(timeout=0))
+        self.assertEqual(self.subscription.get(timeout=0).data, {'text': 'пост'})
+
+    def test_dropped_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                events.publish(['thread:1'], 'post', {'text': 'пост'})
+                raise ValueError()
+        self.assertIsNone(self.subscription.get(timeout=0))
+
+    def test_not_published_without_shared_broker(self):
+        with mock.patch.object(settings, 'EVENTS_SINGLE_PROCESS', False):
+            events.publish(['thread:1'], 'post', {'text': 'пост'})
+        self.assertIsNone(self.subscription.get(timeout=0))
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+    """
+    Сжатие ответов: выбор кодировки, пороги, заголовки и кэш сжатых вариантов.
+    """
+    content = json.dumps({'text': 'Кошки спят на диване. ' * 100}).encode()
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.get_cache().clear()
+
+    def process(self, response, accept_encoding: str = 'gzip'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda _: response)(request)
+
+    def json_response(self, content: bytes = None, content_type: str = 'application/json'):
+        return HttpResponse(self.content if content is None else content, content_type=content_type)
+
+    def test_choose_encoding(self):
+        best = 'br' if brotli is not None else 'gzip'
+        self.assertEqual(choose_encoding('gzip, deflate, br'), best)
+        self.assertEqual(choose_encoding('*'), best)
+        self.assertEqual(choose_encoding('br;q=0, *'), 'gzip')
+        self.assertEqual(choose_encoding('*;q=0, gzip;q=0.5'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, br;q=0'))
+        self.assertIsNone(choose_encoding('*;q=0'))
+        self.assertIsNone(choose_encoding('identity'))
+        self.assertIsNone(choose_encoding(''))
+
+    def test_gzip(self):
+        response = self.process(self.json_response())
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.content)
+
+    def test_not_accepted(self):
+        response = self.process(self.json_response(), 'gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')  # Другой клиент получил бы сжатый ответ
+
+    def test_thresholds(self):
+        small = self.process(self.json_response(self.content[:settings.COMPRESS_MIN_SIZE - 1]))
+        html = self.process(self.json_response(content_type='text/html'))
+        for response in (small, html):
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertFalse(response.has_header('Vary'))
+        self.assertEqual(html.content, self.content)
+        with mock.patch.object(settings, 'COMPRESS_MIN_SIZE', len(self.content) + 1):
+            self.assertFalse(self.process(self.json_response()).has_header('Content-Encoding'))
+
+    def test_weak_etag(self):
+        response = self.json_response()
+        response['ETag'] = '"v1"'
+        self.assertEqual(self.process(response)['ETag'], 'W/"v1"')
+        response = self.json_response()
+        response['ETag'] = 'W/"v1"'
+        self.assertEqual(self.process(response)['ETag'], 'W/"v1"')
+
+    def test_streaming_untouched(self):
+        response = StreamingHttpResponse(iter([self.content]), content_type='application/json')
+        response = self.process(response)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_compressed_variant_cached(self):
+        def cached_response():
+            response = self.json_response()
+            response.compression_cache_key = 'key'
+            response.compression_cache_timeout = 60
+            return response
+
+        with mock.patch.object(middleware, 'compress', wraps=middleware.compress) as compress:
+            first = self.process(cached_response())
+            second = self.process(cached_response())
+            other = self.process(self.json_response())
+        self.assertEqual(compress.call_count, 2)  # Второй ответ взят из кэша, третий не кэшируется
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first.content, other.content)
+
+
+@override_settings(MIDDLEWARE=['api.middleware.CompressionMiddleware'])
+class CompressedConditionalGetTest(ApiTestCase):
+    """
+    Ослабленный сжатием ETag по-прежнему дает ответ 304.
+    """
+
+    def test_not_modified(self):
+        url = reverse('get-thread', args=['b', self.create_thread('т' * 2000)])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'), response['ETag'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.has_header('Content-Encoding'))
@@ -20,13 +20,27 @@ from api import views as v
 urlpatterns = [
     path('board/', v.get_all_boards, name='get-all-boards'),
     path('board/<str:board_name>/<int:page>/', v.get_all_threads, name='get-all-threads'),
+    path('board/<str:board_name>/threads/', v.get_threads_page, name='get-threads-page'),
+    path('board/<str:board_name>/catalog/', v.get_board_catalog, name='get-board-catalog'),
+    path('board/<str:board_name>/search/', v.search_board, name='search-board'),
+    path('search/', v.search_all, name='search-all'),
 
     path('board/<str:board_name>/thread/<int:thread_id>/', v.get_thread, name='get-thread'),
+    path('board/<str:board_name>/thread/<int:thread_id>/since/<int:post_id>/', v.get_thread_updates,
+         name='get-thread-updates'),
+    path('board/<str:board_name>/events/', v.get_board_events, name='get-board-events'),
+    path('board/<str:board_name>/thread/<int:thread_id>/events/', v.get_thread_events, name='get-thread-events'),
     path('board/<str:board_name>/thread/', v.create_thread, name='create-thread'),
 
     path('board/<str:board_name>/post/<int:post_id>/', v.get_post, name='get-post'),
     path('board/<str:board_name>/thread/<int:thread_id>/post/', v.create_post, name='create-post'),
 
+    path('file/check/', v.check_files, name='check-files'),
     path('file/<str:file_hash>/', v.get_file, name='get-file'),
+    path('file/<str:file_hash>/status/', v.get_file_status, name='get-file-status'),
+    path('file/<str:file_hash>/similar/', v.get_similar_files, name='get-similar-files'),
     path('board/<str:board_name>/file/', v.upload_file, name='upload-file'),
+    path('board/<str:board_name>/upload/', v.create_upload_session, name='create-upload-session'),
+    path('upload/<uuid:session_id>/', v.upload_chunk, name='upload-chunk'),
+    path('upload/<uuid:session_id>/finish/', v.finish_upload, name='finish-upload'),
 ]
@@ -13,35 +13,114 @@
 Реализация методов API.
 """
 
-import hashlib
 import logging
 import os
+import shutil
 import tempfile
-from io import BytesIO
-from typing import Dict, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-import cv2
-from PIL import Image
-from PIL.JpegImagePlugin import JpegImageFile
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.db import IntegrityError, DataError
-from django.http import JsonResponse, Http404
+from django.core.files import File as DjangoFile
+from django.db import IntegrityError, DataError, connection, transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from filetype import filetype
-from filetype.types import IMAGE, VIDEO
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import MethodNotAllowed
 from rest_framework.generics import get_object_or_404
 from rest_framework.parsers import JSONParser
 
-from api.models import Post, File, Thread, Board
-from api.serializers import PostSerializer, ThreadSerializer, BoardSerializer, FileSerializer
+from api.cache import BOARDS_SCOPE, board_scope, bump, cached_json, remember, thread_scope
+from api.encoders import JsonResponse
+from api.events import board_channel, publish, stream, streams_enabled, thread_channel
+from api.fast_serializers import serialize_posts
+from api.media import UploadRejected, store_upload
+from api.models import Post, File, Thread, Board, UploadSession, THREADS_PER_PAGE
+from api.phash import MAX_INDEXED_DISTANCE, to_unsigned
+from api.queries import decode_cursor, encode_cursor, get_catalog, get_preview_posts, get_threads_after, \
+    search_posts
+from api.serializers import PostSerializer, BoardSerializer, FileSerializer
+from api.snapshots import append_post, get_thread_json, lock_snapshot
+from gchan import settings
 
 log = logging.getLogger(__name__)
 
-THREADS_PER_PAGE = 10
+MAX_CHECK_HASHES = 16
+MAX_SEARCH_QUERY_LENGTH = 256
+
+
+def conditional(get_version: Callable[..., Optional[Tuple]]):
+    """
+    Условные GET: ETag и Last-Modified считаются одним дешевым запросом ``get_version``
+    до сериализации, и неизменившийся ресурс отдается ответом 304.
+
+    :param get_version: Принимает аргументы view и возвращает кортеж, первый элемент
+        которого — время последнего изменения ресурса, или ``None``, если ресурса нет.
+    """
+    def get_cached_version(request, *args, **kwargs):
+        # condition() вызывает и etag_func, и last_modified_func, а запрос к базе нужен один
+        if not hasattr(request, '_resource_version'):
+            request._resource_version = get_version(*args, **kwargs)
+        return request._resource_version
+
+    def etag(request, *args, **kwargs):
+        version = get_cached_version(request, *args, **kwargs)
+        if version is None:
+            return None
+        return '-'.join(value.isoformat() if isinstance(value, datetime) else str(value) for value in version)
+
+    def last_modified(request, *args, **kwargs):
+        version = get_cached_version(request, *args, **kwargs)
+        return None if version is None else version[0]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def boards_version() -> Optional[Tuple]:
+    """
+    Время последнего изменения досок и их количество (на случай удаления доски).
+    """
+    version = Board.objects.aggregate(modified_at=Max('modified_at'), count=Count('pk'))
+    return None if version['modified_at'] is None else (version['modified_at'], version['count'])
+
+
+def board_version(board_name, page=None) -> Optional[Tuple]:
+    """
+    Время последнего изменения доски: меняется с каждым постом, удалением треда и правкой.
+    """
+    return Board.objects.filter(board_name=board_name).values_list('modified_at').first()
+
+
+def thread_version(board_name, thread_id) -> Optional[Tuple]:
+    """
+    Время последнего изменения треда: меняется с каждым постом и правкой треда или его постов.
+    """
+    return Thread.objects.filter(board__board_name=board_name, posts__id=thread_id).values_list('modified_at').first()
+
+
+def get_thread_pk(thread_id) -> int:
+    """
+    ``pk`` треда, в котором лежит пост ``thread_id`` (пост не меняет тред, так что значение кэшируется).
+
+    :raise Http404: Если поста нет.
+    """
+    thread_pk = remember(f'thread-of-post:{thread_id}',
+                         lambda: Post.objects.filter(pk=thread_id).values_list('thread_id', flat=True).first())
+    if thread_pk is None:
+        raise Http404()
+    return thread_pk
+
+
+def post_version(board_name, post_id) -> Optional[Tuple]:
+    """
+    Время последнего изменения треда, в котором лежит пост.
+    """
+    return Post.objects.filter(board__board_name=board_name, post_id=post_id) \
+        .values_list('thread__modified_at').first()
 
 
 def create_post_or_thread(request, board_name, thread_id=None) -> JsonResponse:
@@ -79,122 +158,332 @@ def create_post_or_thread(request, board_name, thread_id=None) -> JsonResponse:
     # TODO: text size check
     # TODO: rate limiting
     try:
-        if thread_id is None:
-            thread = Thread.objects.create(
-                pinned=False,
-                closed=False,
-                board=board,
-                last_bump_time=timezone.now()
+        with transaction.atomic():
+            if thread_id is None:
+                thread = Thread.objects.create(
+                    pinned=False,
+                    closed=False,
+                    board=board,
+                    last_bump_time=timezone.now()
+                )
+            email = data.get('email', '')
+            # noinspection PyUnboundLocalVariable
+            post = Post.objects.create(
+                post_id=board.reserve_post_id(),
+                text=data.get('text', None),
+                email=email,
+                name=data.get('name', None) or board.default_name,
+                subject=data.get('subject', ''),
+                trip_code=data.get('trip_code', ''),
+                op=data.get('op', False),
+                thread=thread,
+                board=board
             )
-            thread.save()
-        # noinspection PyBroadException
-        try:
-            new_post_id = Post.objects.filter(thread__board=board).last().post_id + 1
-        except Exception:
-            log.warning('Unknown new post id...', exc_info=True)
-            new_post_id = 1
-        email = data.get('email', '')
-        # noinspection PyUnboundLocalVariable
-        post = Post.objects.create(
-            post_id=new_post_id,
-            text=data.get('text', None),
-            email=email,
-            name=data.get('name', None) or board.default_name,
-            subject=data.get('subject', ''),
-            trip_code=data.get('trip_code', ''),
-            op=data.get('op', False),
-            thread=thread
-        )
-        if thread_id is not None and email != "sage" and thread.posts.count() <= board.bump_limit:
-            thread.last_bump_time = timezone.now()
+            post.files.add(*files)
+            snapshot = lock_snapshot(thread) if thread_id is not None else None
+            thread.add_post(post, with_files=len(files) > 0)
+            bumped = thread_id is not None and email != "sage" and thread.post_count <= board.bump_limit
+            if bumped:
+                thread.last_bump_time = timezone.now()
+            try:
+                post.full_clean()
+            except ValidationError as e:
+                transaction.set_rollback(True)
+                return JsonResponse({'success': False, 'errors': e.message_dict})
+            post.save()
+            thread.save(update_fields=['last_bump_time'])
+            bump(board_scope(board.board_name), thread_scope(thread.pk))
+            post_data = PostSerializer(post).data
+            if snapshot is not None:
+                append_post(snapshot, thread, post_data)
+            event = {'thread': thread.op_post_id, 'post': post_data}
+            publish([board_channel(board.board_name), thread_channel(thread.pk)], 'post', event)
+            if bumped:
+                publish([board_channel(board.board_name)], 'bump',
+                        {'thread': thread.op_post_id, 'last_bump_time': thread.last_bump_time})
+            if not settings.DEFERRED_PRUNING:
+                board.prune_threads()
     except (IntegrityError, DataError) as e:
         info = e.args[0].split('\n')[0]
         return JsonResponse({'success': False, 'details': f'Не все необходимые поля заполнены: {info}'})
     except ValidationError as e:
         return JsonResponse({'success': False, 'details': ', '.join(e.messages)})
-    post.files.add(*files)
-    try:
-        post.full_clean()
-    except ValidationError as e:
-        return JsonResponse({'success': False, 'errors': e.message_dict})
-    post.save()
-    thread.save()
-    while board.threads.count() > THREADS_PER_PAGE * board.pages:
-        thread_to_delete = board.threads.last()
-        log.debug('Deleting %s...', thread_to_delete)
-        thread_to_delete.delete()
-    return JsonResponse({'success': True, 'data': PostSerializer(post).data}, safe=False)
+    return JsonResponse({'success': True, 'data': post_data}, safe=False)
 
 
 @api_view(["GET"], )
 @csrf_exempt
+@conditional(boards_version)
 def get_all_boards(request) -> JsonResponse:
     """
     Возвращает список досок.
 
     :param request: Запрос.
     """
-    boards = Board.objects.all()
-    serializer = BoardSerializer(boards, many=True)
-    return JsonResponse(serializer.data, safe=False)
+    def build():
+        boards = Board.objects.all()
+        serializer = BoardSerializer(boards, many=True)
+        return JsonResponse(serializer.data, safe=False)
+
+    return cached_json('boards', [BOARDS_SCOPE], build)
 
 
 @api_view(["GET"], )
 @csrf_exempt
+@conditional(board_version)
 def get_all_threads(request, board_name, page) -> JsonResponse:
     """
     Возвращает список тредов с доски.
-    Каждый объект треда содержит в себе ОП-пост и три последних поста.
+    Каждый объект треда содержит в себе ОП-пост, несколько последних постов
+    (``Board.preview_posts``), количество постов и постов с файлами.
+    Количество запросов к базе не зависит от количества тредов.
+    Страницы кэшируются до следующего поста на доске.
+    ``next_cursor`` позволяет продолжить листание через ``get_threads_page``.
 
     :param request: Запрос.
     :param board_name: Короткое имя доски.
     :param page: Страница.
     :raise Http404: Если доска не найдена.
     """
-    threads = Thread.objects.filter(board__board_name=board_name)[
-              page * THREADS_PER_PAGE: (page + 1) * THREADS_PER_PAGE]
-    board = get_object_or_404(Board, board_name=board_name)
+    def build():
+        board = get_object_or_404(Board, board_name=board_name)
+        # Лишний тред показывает, есть ли следующая страница
+        threads = list(board.threads.all()[page * THREADS_PER_PAGE: (page + 1) * THREADS_PER_PAGE + 1])
+        next_cursor = None
+        if len(threads) > THREADS_PER_PAGE:
+            threads = threads[:THREADS_PER_PAGE]
+            next_cursor = encode_cursor(threads[-1])
+        return JsonResponse(serialize_threads_page(board, threads, next_cursor))
+
+    return cached_json(f'threads:{board_name}:{page}', [board_scope(board_name)], build)
+
+
+@api_view(["GET"], )
+@csrf_exempt
+@conditional(board_version)
+def get_threads_page(request, board_name) -> JsonResponse:
+    """
+    Возвращает страницу тредов с доски, как ``get_all_threads``, но вместо номера
+    страницы принимает параметр ``cursor`` из ``next_cursor`` предыдущей страницы
+    (без него — первая страница). Треды не повторяются и не пропускаются между
+    страницами при бампах, а глубокие страницы не медленнее первой.
+
+    :param request: Запрос.
+    :param board_name: Короткое имя доски.
+    :raise Http404: Если доска не найдена.
+    """
+    cursor = request.GET.get('cursor')
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'details': str(e)}, status=400)
+
+    def build():
+        board = get_object_or_404(Board, board_name=board_name)
+        threads, next_cursor = get_threads_after(board, after, THREADS_PER_PAGE)
+        return JsonResponse(serialize_threads_page(board, threads, next_cursor))
+
+    # Ключ из разобранного курсора: сырая строка может быть любой длины и записи
+    position = '' if after is None else f'{after[0]:d}:{after[1].isoformat()}:{after[2]}'
+    return cached_json(f'threads-after:{board_name}:{position}', [board_scope(board_name)], build)
+
+
+@api_view(["GET"], )
+@csrf_exempt
+@conditional(board_version)
+def get_board_catalog(request, board_name) -> JsonResponse:
+    """
+    Возвращает каталог доски: все треды одним ответом, у каждого — начало ОП-поста,
+    его первый эскиз, количество постов и постов с файлами и время бампа.
+    Кэшируется до следующего поста на доске.
+
+    :param request: Запрос.
+    :param board_name: Короткое имя доски.
+    :raise Http404: Если доска не найдена.
+    """
+    def build():
+        board = get_object_or_404(Board, board_name=board_name)
+        return JsonResponse({'board': board.board_name, 'threads': get_catalog(board)})
+
+    return cached_json(f'catalog:{board_name}', [board_scope(board_name)], build)
+
+
+def search(request, board: Optional[Board]) -> JsonResponse:
+    """
+    Поиск постов для ``search_board`` и ``search_all``.
+
+    :param request: Запрос с параметрами ``q`` и ``page`` (с 1).
+    :param board: Доска или ``None`` для поиска по всем доскам.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'success': False, 'details': 'Нужен поисковый запрос.'})
+    if len(query) > MAX_SEARCH_QUERY_LENGTH:
+        return JsonResponse({'success': False, 'details': f'Запрос длиннее {MAX_SEARCH_QUERY_LENGTH} символов.'})
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+    if page < 1:
+        return JsonResponse({'success': False, 'details': 'Неверный номер страницы.'})
+    posts, has_next = search_posts(query, board, page)
+    return JsonResponse({'success': True, 'page': page, 'has_next': has_next, 'posts': posts})
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def search_board(request, board_name) -> JsonResponse:
+    """
+    Ищет посты на доске по теме, имени, тексту и именам файлов.
+    Результаты отсортированы по релевантности, по ``SEARCH_RESULTS_PER_PAGE`` на страницу.
+
+    :param request: Запрос с параметрами ``q`` и ``page``.
+    :param board_name: Короткое имя доски.
+    :raise Http404: Если доска не найдена.
+    """
+    return search(request, get_object_or_404(Board, board_name=board_name))
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def search_all(request) -> JsonResponse:
+    """
+    Ищет посты на всех досках, как ``search_board``.
+
+    :param request: Запрос с параметрами ``q`` и ``page``.
+    """
+    return search(request, None)
+
+
+def serialize_threads_page(board: Board, threads: List[Thread], next_cursor: Optional[str]) -> Dict:
+    """
+    Страница тредов для ``get_all_threads`` и ``get_threads_page``.
+    """
+    preview_posts = get_preview_posts(threads, board.preview_posts)
     threads_list = []
     for thread in threads:
-        thread_posts = thread.posts.prefetch_related('files')
-        obj = {
+        threads_list.append({
             'pinned': thread.pinned,
             'closed': thread.closed,
-            'posts': [],
-        }
-        obj['posts'].append(PostSerializer(thread_posts.first()).data)  # OP-post
-        latest_posts_reversed = PostSerializer(thread_posts.reverse().all()[:3], many=True).data  # 3 latest posts
-        if thread_posts.count() < 4:
-            latest_posts_reversed = latest_posts_reversed[:-1]  # cut last post (OP-post)
-        obj['posts'].extend(reversed(latest_posts_reversed))
-        threads_list.append(obj)
-
-    result = {
+            'post_count': thread.post_count,
+            'file_post_count': thread.file_post_count,
+            'posts': PostSerializer(preview_posts[thread.pk], many=True).data,  # OP-post and latest posts
+        })
+
+    return {
         'board': BoardSerializer(board).data,
         'threads': threads_list,
+        'next_cursor': next_cursor,
     }
-    return JsonResponse(result)
 
 
 @api_view(["GET"], )
 @csrf_exempt
+@conditional(thread_version)
 def get_thread(request, board_name, thread_id) -> JsonResponse:
     """
     Возвращает тред со списком постов.
+    Тред отдается из готового снимка JSON (см. ``api.snapshots``).
 
     :param request: Запрос.
     :param board_name: Короткое имя доски.
     :param thread_id: Номер треда.
     :raise Http404: Если тред не найден.
     """
-    try:
-        thread_qs = Thread.objects
-        thread_qs = ThreadSerializer.setup_eager_loading(thread_qs)
-        serializer = ThreadSerializer(thread_qs.get(board__board_name=board_name, posts__id=thread_id))
-    except (TypeError, ValueError, ValidationError, Thread.DoesNotExist):
-        log.info('No such thread.', exc_info=True)
+    def build():
+        content = get_thread_json(board_name, thread_pk)
+        if content is None:
+            log.info('No such thread.')
+            raise Http404()
+        return HttpResponse(content, content_type='application/json')
+
+    thread_pk = get_thread_pk(thread_id)
+    return cached_json(f'thread:{board_name}:{thread_id}', [thread_scope(thread_pk)], build)
+
+
+@api_view(["GET"], )
+@csrf_exempt
+@conditional(lambda board_name, thread_id, post_id: thread_version(board_name, thread_id))
+def get_thread_updates(request, board_name, thread_id, post_id) -> JsonResponse:
+    """
+    Возвращает состояние треда и только посты с номером больше ``post_id``
+    (для автообновления треда). Посты выбираются по индексу (тред, номер поста),
+    так что стоимость зависит от количества новых постов, а не от длины треда.
+
+    :param request: Запрос.
+    :param board_name: Короткое имя доски.
+    :param thread_id: Номер треда.
+    :param post_id: Номер последнего уже полученного поста.
+    :raise Http404: Если тред не найден.
+    """
+    def build():
+        try:
+            thread = Thread.objects.get(board__board_name=board_name, posts__id=thread_id)
+        except (TypeError, ValueError, ValidationError, Thread.DoesNotExist):
+            log.info('No such thread.', exc_info=True)
+            raise Http404()
+        return JsonResponse({
+            'pinned': thread.pinned,
+            'closed': thread.closed,
+            'post_count': thread.post_count,
+            'file_post_count': thread.file_post_count,
+            'last_post_id': thread.last_post_id,
+            'posts': serialize_posts(Post.objects.filter(thread=thread, post_id__gt=post_id)),
+        })
+
+    thread_pk = get_thread_pk(thread_id)
+    return cached_json(f'thread-since:{board_name}:{thread_id}:{post_id}', [thread_scope(thread_pk)], build)
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def get_board_events(request, board_name) -> StreamingHttpResponse:
+    """
+    Поток событий доски (Server-Sent Events): ``post`` на каждый новый пост
+    и ``bump`` на каждый бамп треда.
+
+    :param request: Запрос; ``Last-Event-ID`` (или параметр ``last_event_id``) продолжает оборванный поток.
+    :param board_name: Короткое имя доски.
+    :raise Http404: Если доска не найдена.
+    """
+    get_object_or_404(Board.objects.values_list('pk'), board_name=board_name)
+    return event_stream(request, board_channel(board_name))
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def get_thread_events(request, board_name, thread_id) -> StreamingHttpResponse:
+    """
+    Поток событий треда (Server-Sent Events): ``post`` на каждый новый пост.
+
+    :param request: Запрос; ``Last-Event-ID`` (или параметр ``last_event_id``) продолжает оборванный поток.
+    :param board_name: Короткое имя доски.
+    :param thread_id: Номер треда.
+    :raise Http404: Если тред не найден.
+    """
+    version = Thread.objects.filter(board__board_name=board_name, posts__id=thread_id).values_list('pk').first()
+    if version is None:
         raise Http404()
-    return JsonResponse(serializer.data, safe=False)
+    return event_stream(request, thread_channel(version[0]))
+
+
+def event_stream(request, channel: str) -> StreamingHttpResponse:
+    """
+    Отдает события канала потоком.
+    Событие ``reset`` значит, что часть событий потеряна: клиенту нужно перезапросить данные.
+    Если потоки выключены (см. ``streams_enabled``), отвечает 503: клиенту нужно
+    обновлять тред запросами (``get_thread_updates``).
+    """
+    if not streams_enabled():
+        return JsonResponse({'success': False, 'details': 'Живое обновление выключено.'}, status=503)
+    try:
+        last_event_id = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        last_event_id = None
+    response = StreamingHttpResponse(stream(channel, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+    return response
 
 
 @api_view(["POST"], )
@@ -213,6 +502,7 @@ def create_thread(request, board_name) -> JsonResponse:
 
 @api_view(["GET"], )
 @csrf_exempt
+@conditional(post_version)
 def get_post(request, board_name, post_id) -> JsonResponse:
     """
     Получает один пост.
@@ -222,9 +512,18 @@ def get_post(request, board_name, post_id) -> JsonResponse:
     :param post_id: Номер поста.
     :raise Http404: Если пост не найден.
     """
-    post = get_object_or_404(Post, post_id=post_id, thread__board__board_name=board_name)
-    serializer = PostSerializer(post)
-    return JsonResponse(serializer.data, safe=False)
+    def build():
+        post = get_object_or_404(Post.objects.prefetch_related('files__renditions'),
+                                 post_id=post_id, board__board_name=board_name)
+        serializer = PostSerializer(post)
+        return JsonResponse(serializer.data, safe=False)
+
+    thread_pk = remember(f'thread-of-board-post:{board_name}:{post_id}',
+                         lambda: Post.objects.filter(board__board_name=board_name, post_id=post_id)
+                         .values_list('thread_id', flat=True).first())
+    if thread_pk is None:
+        raise Http404()
+    return cached_json(f'post:{board_name}:{post_id}', [thread_scope(thread_pk)], build)
 
 
 @api_view(["POST"], )
@@ -256,129 +555,288 @@ def get_file(request, file_hash) -> JsonResponse:
     return JsonResponse(serializer.data, safe=False)
 
 
+@api_view(["POST"], )
+@csrf_exempt
+def check_files(request) -> JsonResponse:
+    """
+    Проверяет, какие файлы уже есть на сервере, по их SHA512 хэшам
+    (до ``MAX_CHECK_HASHES`` за раз). Уже известные файлы можно сразу указывать
+    в посте, не загружая их заново.
+
+    :param request: Запрос с JSON вида ``{"hashes": [...]}``.
+    :return: Найденные файлы (по хэшу) и список ненайденных хэшей.
+    """
+    data: Dict = JSONParser().parse(request)
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or not all(isinstance(file_hash, str) for file_hash in hashes):
+        return JsonResponse({'success': False, 'details': 'Нужен список хэшей.'})
+    if len(hashes) > MAX_CHECK_HASHES:
+        return JsonResponse({'success': False, 'details': f'Нельзя проверить больше {MAX_CHECK_HASHES} хэшей.'})
+    files = File.objects.filter(hash__in=hashes).prefetch_related('renditions')
+    existing = {file.hash: FileSerializer(file).data for file in files}
+    return JsonResponse({
+        'success': True,
+        'existing': existing,
+        'missing': [file_hash for file_hash in hashes if file_hash not in existing],
+    })
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def get_file_status(request, file_hash) -> JsonResponse:
+    """
+    Получает состояние обработки файла: ``pending``, пока эскиз не готов,
+    ``ready`` или ``failed``.
+
+    :param request: Запрос.
+    :param file_hash: SHA512 хэш файла.
+    :raise Http404: Если файл не найден.
+    """
+    status = get_object_or_404(File.objects.values_list('status', flat=True), hash=file_hash)
+    return JsonResponse({'hash': file_hash, 'status': status})
+
+
+@api_view(["GET"], )
+@csrf_exempt
+def get_similar_files(request, file_hash) -> JsonResponse:
+    """
+    Ищет файлы, похожие на указанный по перцептивному хэшу.
+    Параметр ``distance`` — максимальное расстояние в битах (от 0 до 3, по умолчанию 3).
+
+    :param request: Запрос.
+    :param file_hash: SHA512 хэш файла.
+    :return: Массив объектов с расстоянием и файлом, ближайшие первыми.
+    :raise Http404: Если файл не найден.
+    """
+    file = get_object_or_404(File, hash=file_hash)
+    try:
+        max_distance = int(request.GET.get('distance', MAX_INDEXED_DISTANCE))
+        similar = File.find_similar(to_unsigned(file.phash), max_distance) if file.phash is not None else []
+    except ValueError as e:
+        return JsonResponse({'success': False, 'details': str(e)})
+    return JsonResponse([
+        {'distance': distance, 'file': FileSerializer(similar_file).data}
+        for distance, similar_file in similar if similar_file.pk != file.pk
+    ], safe=False)
+
+
 @csrf_exempt
 def upload_file(request, board_name) -> Union[JsonResponse, MethodNotAllowed]:
     """
-    Загружает файл на сервер.
-    Файл хэшируется, с него читаются метаданные, для него создается эскиз,
-    эскиз и контент грузяться на Amazon S3.
+    Загружает файлы на сервер, параллельно (до ``UPLOAD_CONCURRENCY`` одновременно).
+    Каждый файл читается потоково: по чанкам хэшируется и проверяется на размер,
+    контент грузится на Amazon S3, а эскиз создается в фоне
+    (см. ``get_file_status``).
 
     :param request: Запрос с файлами (до четырех).
     :param board_name: Имя целевой доски для постинга файла (у каждой доски свое ограничение на размер).
-    :return: Массив с именами фалов и результатом загрузки.
+    :return: Массив с именами фалов и результатом загрузки, в порядке файлов запроса.
     :raise Http404: Если доска не найдена.
     """
     if request.method != 'POST':
         return MethodNotAllowed(request.method)
 
-    result = []
-
     max_file_size = get_object_or_404(Board, board_name=board_name).max_file_size * 1024
-    for filename, file in request.FILES.items():  # TODO: limit files count to 4
-        data = file.read(max_file_size + 1)
-        if len(data) > max_file_size:
-            file.close()
-            result.append({
-                filename: {
-                    'success': False,
-                    'details': f'Файл слишком большой, максимальный размер: {max_file_size / 1024}KB'
-                }
-            })
-            continue
-
-        fformat = filetype.guess(data)
-        if fformat is None or not File.FileTypeEnum.has_value(fformat.EXTENSION):
-            result.append({
-                filename: {
-                    'success': False,
-                    'details': f'Файл неверного типа ({fformat.MIME if fformat is not None else "неизвестно"}),'
-                    f' разрешены: {list(File.FileTypeEnum.list_values())} '
-                }
-            })
-            continue
-
-        file_hash = hashlib.sha512(data).hexdigest()
-        if File.objects.filter(hash=file_hash).exists():
-            result.append({
-                filename: {
-                    'success': True,
-                    'hash': file_hash
-                }
-            })
-            continue
-
-        if fformat in IMAGE:
-            max_thumb_size = 250
-            image = Image.open(BytesIO(data))
-            resize_ratio = min(max_thumb_size / image.width, max_thumb_size / image.height)
-            thumbnail = image.resize((int(image.width * resize_ratio), int(image.height * resize_ratio)),
-                                     Image.LANCZOS)
-            thumbnail = thumbnail.convert('RGB')
-            thumbnail_bytes = BytesIO()
-            thumbnail.save(thumbnail_bytes, format='JPEG', quality=70)
-
-            model_file = File(
-                hash=file_hash,
-                filename=filename,
-                width=image.width,
-                height=image.height,
-                size=len(data),
-                thumbnailWidth=thumbnail.width,
-                thumbnailHeight=thumbnail.height,
-                filetype=fformat.EXTENSION
-            )
-            model_file.content.save(f'c_{file_hash}', ContentFile(data))
-            model_file.preview_content.save(f'p_{file_hash}', ContentFile(thumbnail_bytes.getvalue()))
-            model_file.save()
-
-            result.append({
-                filename: {
-                    'success': True,
-                    'hash': file_hash
-                }
-            })
-        elif fformat in VIDEO:
-            temp_file = os.path.join(tempfile.gettempdir(), f'{file_hash}.webm')
-            with open(temp_file, 'wb') as fd:
-                fd.write(data)
-            vid = cv2.VideoCapture(temp_file)
-            _, frame = vid.read()
-            vid.release()
-            os.remove(temp_file)
-            temp_file = os.path.join(tempfile.gettempdir(), f'{file_hash}.jpg')
-            cv2.imwrite(temp_file, frame)
-
-            with open(temp_file, 'rb') as fd:
-                max_thumb_size = 250
-                thumbnail: JpegImageFile = Image.open(fd)
-                width = thumbnail.width
-                height = thumbnail.height
-                resize_ratio = min(max_thumb_size / width, max_thumb_size / height)
-                thumbnail = thumbnail.resize((int(width * resize_ratio), int(height * resize_ratio)),
-                                             Image.LANCZOS)
-                thumbnail = thumbnail.convert('RGB')
-                thumbnail_bytes = BytesIO()
-                thumbnail.save(thumbnail_bytes, format='JPEG', quality=85)
-            os.remove(temp_file)
-            model_file = File(
-                hash=file_hash,
-                filename=filename,
-                width=width,
-                height=height,
-                size=len(data),
-                thumbnailWidth=thumbnail.width,
-                thumbnailHeight=thumbnail.height,
-                filetype=fformat.EXTENSION
-            )
-            model_file.content.save(f'c_{file_hash}', ContentFile(data))
-            model_file.preview_content.save(f'p_{file_hash}', ContentFile(thumbnail_bytes.getvalue()))
-            model_file.save()
-
-            result.append({
-                filename: {
-                    'success': True,
-                    'hash': file_hash
-                }
-            })
+    files = list(request.FILES.items())  # TODO: limit files count to 4
+    if len(files) <= 1 or settings.UPLOAD_CONCURRENCY <= 1:
+        result = [upload_one_file(filename, file, max_file_size) for filename, file in files]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(files), settings.UPLOAD_CONCURRENCY)) as executor:
+            result = list(executor.map(lambda item: upload_one_file(*item, max_file_size, in_thread=True), files))
 
     return JsonResponse({'response': result})
+
+
+def upload_one_file(filename, file, max_file_size, in_thread=False) -> Dict:
+    """
+    Загружает один файл из запроса. Ошибки не выходят за пределы файла:
+    остальные файлы запроса загружаются независимо от них.
+
+    :param filename: Имя файла.
+    :param file: Загруженный файл.
+    :param max_file_size: Максимальный размер файла в байтах.
+    :param in_thread: Вызвано в потоке пула, соединение с базой нужно закрыть.
+    :return: Результат загрузки для ответа ``upload_file``.
+    """
+    try:
+        file_hash = store_upload(filename, file, max_file_size)
+    except UploadRejected as e:
+        return {
+            filename: {
+                'success': False,
+                'details': str(e)
+            }
+        }
+    except Exception:
+        log.exception('Failed to upload %s.', filename)
+        return {
+            filename: {
+                'success': False,
+                'details': 'Не удалось обработать файл.'
+            }
+        }
+    finally:
+        file.close()
+        if in_thread:
+            connection.close()
+    return {
+        filename: {
+            'success': True,
+            'hash': file_hash
+        }
+    }
+
+
+@api_view(["POST"], )
+@csrf_exempt
+def create_upload_session(request, board_name) -> JsonResponse:
+    """
+    Начинает загрузку файла по частям.
+    Дальше части отправляются в ``upload_chunk``, а загрузка завершается ``finish_upload``.
+
+    :param request: Запрос с JSON вида ``{"filename": ..., "size": ...}``.
+    :param board_name: Имя целевой доски (у каждой доски свое ограничение на размер).
+    :return: Идентификатор сессии, принятое смещение и время истечения.
+    :raise Http404: Если доска не найдена.
+    """
+    board = get_object_or_404(Board, board_name=board_name)
+    data: Dict = JSONParser().parse(request)
+    filename, size = data.get('filename'), data.get('size')
+    if not isinstance(filename, str) or not filename or not isinstance(size, int) or size <= 0:
+        return JsonResponse({'success': False, 'details': 'Нужны имя и размер файла.'})
+    if size > board.max_file_size * 1024:
+        return JsonResponse({'success': False, 'details': f'Размер файла превышает {board.max_file_size} КиБ.'})
+
+    session = UploadSession.objects.create(
+        board=board,
+        filename=filename[:256],
+        size=size,
+        expires_at=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL),
+    )
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    open(session.spool_path, 'wb').close()
+    return JsonResponse({'success': True, **upload_session_state(session)})
+
+
+@csrf_exempt
+def upload_chunk(request, session_id) -> JsonResponse:
+    """
+    ``GET`` возвращает, сколько байт уже принято (чтобы продолжить оборванную загрузку).
+    ``PUT`` дописывает тело запроса в файл сессии с позиции из заголовка ``Upload-Offset``,
+    которая должна совпадать с уже принятым размером.
+
+    :param request: Запрос (для ``PUT`` тело — очередная часть файла, до ``UPLOAD_CHUNK_MAX_SIZE`` байт).
+    :param session_id: Идентификатор сессии загрузки.
+    :return: Состояние сессии; 409, если смещение не совпало; 410, если принятых частей нет на этом сервере.
+    :raise Http404: Если сессия не найдена или истекла.
+    """
+    if request.method == 'GET':
+        session = get_upload_session(UploadSession.objects.all(), session_id)
+        return JsonResponse({'success': True, **upload_session_state(session)})
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'details': f'Метод {request.method} не поддерживается.'}, status=405)
+
+    try:
+        offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        length = int(request.META['CONTENT_LENGTH'])
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'details': 'Нужны заголовки Upload-Offset и Content-Length.'})
+    if length <= 0 or length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        return JsonResponse({'success': False,
+                             'details': f'Размер части должен быть от 1 до {settings.UPLOAD_CHUNK_MAX_SIZE} байт.'})
+
+    # Смещение проверяется заранее, чтобы не принимать заведомо лишнюю часть
+    session = get_upload_session(UploadSession.objects.all(), session_id)
+    if offset != session.offset:
+        return JsonResponse({'success': False, 'details': 'Смещение не совпадает с принятым размером.',
+                             **upload_session_state(session)}, status=409)
+    if offset + length > session.size:
+        return JsonResponse({'success': False, 'details': 'Часть выходит за пределы файла.'})
+
+    # Тело читается от клиента (возможно, медленного) до транзакции и блокировки
+    with tempfile.TemporaryFile() as chunk_file:
+        received = 0
+        while received < length:
+            chunk = request.read(min(64 * 1024, length - received))
+            if not chunk:
+                break
+            chunk_file.write(chunk)
+            received += len(chunk)
+        chunk_file.seek(0)
+
+        with transaction.atomic():  # Блокировка строки не дает двум запросам писать в одну сессию
+            session = get_upload_session(UploadSession.objects.select_for_update(), session_id)
+            if offset != session.offset:
+                return JsonResponse({'success': False, 'details': 'Смещение не совпадает с принятым размером.',
+                                     **upload_session_state(session)}, status=409)
+            if not os.path.exists(session.spool_path):
+                return spool_missing(session)
+            with open(session.spool_path, 'r+b') as spool:
+                spool.seek(offset)
+                shutil.copyfileobj(chunk_file, spool)
+                spool.truncate()  # Недописанный хвост будет отправлен заново
+            session.offset += received
+            session.save(update_fields=['offset'])
+    return JsonResponse({'success': True, **upload_session_state(session)})
+
+
+def spool_missing(session: UploadSession) -> JsonResponse:
+    """
+    Ответ, если файла сессии нет на этом сервере: ``UPLOAD_SPOOL_DIR``
+    не общий для всех процессов или файл удалили.
+    """
+    log.error('Spool file of upload session %s not found in %s; UPLOAD_SPOOL_DIR must be shared by all '
+              'web processes.', session.pk, settings.UPLOAD_SPOOL_DIR)
+    return JsonResponse({'success': False, 'details': 'Принятые части файла не найдены, начните загрузку заново.'},
+                        status=410)
+
+
+@api_view(["POST"], )
+@csrf_exempt
+def finish_upload(request, session_id) -> JsonResponse:
+    """
+    Завершает загрузку по частям: полученный файл хэшируется и обрабатывается
+    так же, как в ``upload_file``. Сессия после этого удаляется.
+
+    :param request: Запрос.
+    :param session_id: Идентификатор сессии загрузки.
+    :return: Результат загрузки в формате ``upload_file``.
+    :raise Http404: Если сессия не найдена или истекла.
+    """
+    with transaction.atomic():
+        session = get_upload_session(UploadSession.objects.select_for_update().select_related('board'), session_id)
+        if session.offset != session.size:
+            return JsonResponse({'success': False, 'details': 'Файл загружен не полностью.',
+                                 **upload_session_state(session)})
+        spool_path = session.spool_path
+        if not os.path.exists(spool_path):
+            return spool_missing(session)
+        session.delete()
+
+    file = DjangoFile(open(spool_path, 'rb'), name=session.filename)
+    try:
+        result = upload_one_file(session.filename, file, session.board.max_file_size * 1024)
+    finally:
+        os.remove(spool_path)
+    return JsonResponse({'response': [result]})
+
+
+def get_upload_session(queryset, session_id) -> UploadSession:
+    """
+    Получает неистекшую сессию загрузки.
+
+    :raise Http404: Если сессия не найдена или истекла.
+    """
+    return get_object_or_404(queryset, pk=session_id, expires_at__gt=timezone.now())
+
+
+def upload_session_state(session: UploadSession) -> Dict:
+    """
+    Состояние сессии загрузки для ответа клиенту.
+    """
+    return {
+        'id': session.id,
+        'offset': session.offset,
+        'size': session.size,
+        'expires_at': session.expires_at,
+    }
@@ -27,6 +27,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 import os
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import platform
+import tempfile
 
 import dj_database_url
 import django_heroku
@@ -62,6 +63,7 @@ INSTALLED_APPS.extend([
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'debug_toolbar',
     'rest_framework',
     'api',
@@ -77,8 +79,8 @@ if not DEBUG:
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    # 'django.middleware.gzip.GZipMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',  # PLACE AFTER GZipMiddleware!!!
+    'api.middleware.CompressionMiddleware',
+    'debug_toolbar.middleware.DebugToolbarMiddleware',  # PLACE AFTER CompressionMiddleware!!!
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -202,11 +204,95 @@ AWS_S3_HOST = os.getenv('S3_HOST', None)
 S3_USE_SIGV4 = True
 AWS_S3_SIGNATURE_VERSION = 's3v4'
 AWS_S3_REGION_NAME = 'eu-west-3'
+# File URLs are signed (AWS_QUERYSTRING_AUTH is on by default) and expire after AWS_QUERYSTRING_EXPIRE seconds.
+# Thread snapshots store rendered URLs, so a snapshot older than SNAPSHOT_MAX_AGE is rebuilt on the next read:
+# every URL it serves stays valid for at least the remaining half of its lifetime.
+AWS_QUERYSTRING_EXPIRE = int(os.getenv('AWS_QUERYSTRING_EXPIRE', 60 * 60))
+SNAPSHOT_MAX_AGE = AWS_QUERYSTRING_EXPIRE // 2
 
 db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
 
 SCOUT_NAME = 'gchan'
 
+# Prune threads that do not fit on board pages with the ``prune_threads`` command
+# (e.g. from a scheduler) instead of doing it while posting.
+DEFERRED_PRUNING = os.getenv('DEFERRED_PRUNING', '0') == '1'
+
+# Build previews with ``thumbnail_worker`` processes instead of inside the upload request.
+THUMBNAILS_IN_BACKGROUND = os.getenv('THUMBNAILS_IN_BACKGROUND', '1') == '1'
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+# Preview renditions built from one decode of every file, in addition to the 250px JPEG preview
+# (``preview_content``), which is always built and should not be repeated here.
+# ``size`` is the longest side, ``format`` is a Pillow format, ``blur`` is an optional Gaussian blur radius.
+PREVIEW_RENDITIONS = [
+    {'name': 'thumb2x', 'size': 500, 'format': 'WEBP', 'quality': 70},
+    {'name': 'placeholder', 'size': 16, 'format': 'JPEG', 'quality': 40, 'blur': 2},
+]
+# Uploads with the same perceptual hash, type and pixels as an existing file
+# reuse its stored content instead of keeping their own copy.
+PHASH_REUSE_CONTENT = os.getenv('PHASH_REUSE_CONTENT', '0') == '1'
+# Resumable uploads: where received chunks are kept, for how long (in seconds)
+# an unfinished upload lives, and the largest chunk accepted by one request.
+# Chunks of one upload may reach any web process, so UPLOAD_SPOOL_DIR must be storage shared
+# by all of them (e.g. a network volume). The default local temp dir only works with a single
+# web server; Heroku dynos do not share a filesystem. Chunks that reach a process without
+# the upload's spool file are rejected with 410 and the upload has to be restarted.
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'gchan-uploads'))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))
+UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE', 8 * 1024 * 1024))
+# Images with more pixels are rejected instead of being decoded.
+THUMBNAIL_MAX_PIXELS = int(os.getenv('THUMBNAIL_MAX_PIXELS', 8192 * 8192))
+# How many files of one upload request are processed concurrently.
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 4))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+}
+# Cache rendered board, thread and post responses (see ``api/cache.py``).
+# Local memory cache is per process and would miss version bumps made by other processes,
+# so by default responses are cached only with a shared backend (memcached, redis...).
+RESPONSE_CACHE_ENABLED = os.getenv(
+    'RESPONSE_CACHE_ENABLED', '0' if CACHES['default']['BACKEND'].endswith('LocMemCache') else '1') == '1'
+RESPONSE_CACHE_ALIAS = 'default'
+# Cached responses contain signed file URLs (see AWS_QUERYSTRING_EXPIRE), so they are kept for at most
+# a quarter of the URL lifetime: built from a snapshot of SNAPSHOT_MAX_AGE, a served URL is still valid
+# for at least another quarter. Compressed variants expire together with the response they were made from.
+RESPONSE_CACHE_TIMEOUT = min(int(os.getenv('RESPONSE_CACHE_TIMEOUT', 10 * 60)), AWS_QUERYSTRING_EXPIRE // 4)
+
+# Live updates (Server-Sent Events, see ``api/events.py``). The in-memory broker only
+# delivers events within one process, so streams are disabled unless the broker is shared
+# or EVENTS_SINGLE_PROCESS is set (one web dyno with WEB_CONCURRENCY=1).
+# An open stream holds a gunicorn worker for up to EVENTS_STREAM_TIMEOUT, and the default sync
+# workers serve one request at a time. When enabling streams, also switch gunicorn to threads, e.g.
+# GUNICORN_CMD_ARGS="--worker-class gthread --threads 8". Streams release their database connection,
+# but every other request thread keeps its own (CONN_MAX_AGE), so size the thread count
+# (plus UPLOAD_CONCURRENCY per upload) times the number of web processes to the Postgres connection limit.
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'api.events.InMemoryBroker')
+EVENTS_SINGLE_PROCESS = os.getenv('EVENTS_SINGLE_PROCESS', '0') == '1'
+# Events kept per channel for resuming with Last-Event-ID.
+EVENTS_HISTORY = int(os.getenv('EVENTS_HISTORY', 100))
+# Events queued for one client; a client that falls further behind gets a ``reset`` event.
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', 100))
+# Seconds between heartbeats, seconds before a stream is closed, seconds before a client reconnects.
+EVENTS_HEARTBEAT = int(os.getenv('EVENTS_HEARTBEAT', 15))
+EVENTS_STREAM_TIMEOUT = int(os.getenv('EVENTS_STREAM_TIMEOUT', 5 * 60))
+EVENTS_RETRY = int(os.getenv('EVENTS_RETRY', 3))
+
+# JSON encoder for API responses: ``orjson`` (optional, must be installed separately),
+# ``stdlib`` or ``auto`` (orjson when it is installed).
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
+
+# Response compression (see ``api/middleware.py``). Brotli is used when the optional
+# ``brotli`` package is installed and the client accepts it, gzip otherwise.
+# Smaller responses are sent as is: compression overhead would outweigh the savings.
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_CONTENT_TYPES = os.getenv('COMPRESS_CONTENT_TYPES', 'application/json').split(',')
+# 0-11; higher levels are much slower for little gain on dynamic responses.
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+
 # Configure Django App for Heroku.
 django_heroku.settings(locals(), logging=False)